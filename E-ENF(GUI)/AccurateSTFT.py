@@ -1,29 +1,207 @@
 import numpy as np  # Import the NumPy library for numerical operations
-from scipy.fftpack import fft  # Import the FFT function from SciPy library
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import czt
 
-def AccurateSTFT(Signal, Window, StepPoints, Fs, NFFT):
+MaxBatchPoints = 2 ** 22  # Frames transformed together hold at most this many samples
+MaxBandPoints = 2 ** 23  # Largest band-limited DFT matrix (frame size x bins) before switching to the chirp-z transform
+
+
+def BandSpectrum(Frames, FirstBin, NumBins, NFFT):
+    # Bins FirstBin .. FirstBin + NumBins - 1 of fft(Frame, NFFT) for every frame
+    FrameSize = Frames.shape[1]
+    if FrameSize * NumBins > MaxBandPoints:
+        return czt(Frames, NumBins, np.exp(-2j * np.pi / NFFT), np.exp(2j * np.pi * FirstBin / NFFT), axis=-1)
+    Angle = 2 * np.pi / NFFT * ((np.arange(FrameSize)[:, None] * np.arange(FirstBin, FirstBin + NumBins)[None, :]) % NFFT)
+    return Frames @ np.cos(Angle) - 1j * (Frames @ np.sin(Angle))
+
+
+def FramesIF(Frames, Fs, NFFT):
+    # Instantaneous frequency of each frame, same as the peak search over fft(Frame, NFFT)[:NFFT / 2]
+    FrameSize = Frames.shape[1]
+    HalfBins = int(NFFT / 2)
+
+    # Coarse spectrum without zero padding: the fine peak lies within one coarse bin of a coarse bin
+    # reaching half of the coarse maximum (the rectangular window loses at most 3.92 dB between bins)
+    Coarse = np.abs(np.fft.rfft(Frames, axis=1))
+    Candidates = np.flatnonzero((Coarse >= 0.5 * Coarse.max(axis=1, keepdims=True)).any(axis=0))
+    LowBin = max(int(np.floor((Candidates[0] - 1) * NFFT / FrameSize)), 0)
+    HighBin = min(int(np.ceil((Candidates[-1] + 1) * NFFT / FrameSize)), HalfBins - 2)
+
+    # Zoomed spectrum on the fine NFFT grid, with one extra bin on each side for the correction
+    HalfTempFFT = BandSpectrum(Frames, max(LowBin - 1, 0), HighBin - max(LowBin - 1, 0) + 2, NFFT)
+    if LowBin == 0:  # the left neighbour of bin 0 is HalfTempFFT[-1], the last bin of the half spectrum
+        HalfTempFFT = np.hstack((BandSpectrum(Frames, HalfBins - 1, 1, NFFT), HalfTempFFT))
+    Rows = np.arange(len(Frames))
+    PeakLoc = np.argmax(np.abs(HalfTempFFT[:, 1:-1]), axis=1) + 1
+    ValueLeft = HalfTempFFT[Rows, PeakLoc - 1]
+    ValueCenter = HalfTempFFT[Rows, PeakLoc]
+    ValueRight = HalfTempFFT[Rows, PeakLoc + 1]
+
+    CorrectionCoef = -((ValueRight - ValueLeft) / (2 * ValueCenter - ValueRight - ValueLeft)).real
+    return (LowBin - 1 + PeakLoc + CorrectionCoef - 1) * Fs / NFFT
+
+
+def AccurateSTFT(Signal, Window, StepPoints, Fs, NFFT, Progress=None):
     # Initialization and Signal Padding
-    FrameSize = Window  # Set the frame size to the specified window size
-    Signal2 = np.zeros(int(FrameSize / 2) * 2 + len(Signal))  # Create an array to hold the padded signal
-    Signal2[int(FrameSize / 2):int(FrameSize / 2) + len(Signal)] = Signal # Pad the original signal with zeros to match the frame size
-    WindowPositions = range(1, len(Signal2) - int(FrameSize) + 2, StepPoints) # Calculate positions for overlapping windows
-    
-    IF0 = np.zeros(len(WindowPositions))  # Initialize an array to store instantaneous frequencies
-
-    # Loop through each window position
-    for i in range(len(WindowPositions)):
-        B = np.array(fft(Signal2[WindowPositions[i]:WindowPositions[i] + int(FrameSize)], NFFT))  # Perform FFT on the windowed signal
-        HalfTempFFT = B[:int(len(B) / 2)]  # Extract the first half of the FFT
-        absHalfTempFFT = abs(HalfTempFFT)  # Compute the absolute values of the FFT coefficients
-
-        # Find the peak frequency in the FFT
-        PeakLoc = np.argmax(absHalfTempFFT)  # Find the index of the maximum value
-        ValueLeft = HalfTempFFT[PeakLoc - 1]  # Value to the left of the peak
-        ValueCenter = HalfTempFFT[PeakLoc]  # Value at the peak
-        ValueRight = HalfTempFFT[PeakLoc + 1]  # Value to the right of the peak
-
-        # Calculate correction coefficient for more accurate peak frequency estimation
-        CorrectionCoef = -((ValueRight - ValueLeft) / (2 * ValueCenter - ValueRight - ValueLeft)).real # Compute the correction coefficient
-        IF0[i] = (PeakLoc + CorrectionCoef - 1) * Fs / NFFT  # Calculate and store the instantaneous frequency
+    FrameSize = int(Window)  # Set the frame size to the specified window size
+    # Pad the original signal with zeros to match the frame size, plus one zero so the last window,
+    # one sample short of FrameSize, is zero padded the same way fft(x, NFFT) pads it
+    Signal2 = np.zeros(int(FrameSize / 2) * 2 + len(Signal) + 1)
+    Signal2[int(FrameSize / 2):int(FrameSize / 2) + len(Signal)] = Signal
+    Frames = sliding_window_view(Signal2, FrameSize)[1::StepPoints]  # Overlapping windows as a strided view
+
+    IF0 = np.zeros(len(Frames))  # Initialize an array to store instantaneous frequencies
+
+    # Transform the windows batch by batch
+    BatchSize = max(1, MaxBatchPoints // FrameSize)
+    for i in range(0, len(Frames), BatchSize):
+        IF0[i:i + BatchSize] = FramesIF(Frames[i:i + BatchSize], Fs, NFFT)
+        if Progress is not None:  # called with the frequencies found so far and the number of frames
+            Progress(IF0[:i + BatchSize], len(Frames))
 
     return IF0  # Return the array of instantaneous frequencies
+
+
+def AccurateSTFTBlocks(Blocks, Window, StepPoints, Fs, NFFT):
+    # AccurateSTFT of a signal given as consecutive blocks, yielding the frequencies of the frames each
+    # block completes; only the samples of the frames not yet complete are kept
+    FrameSize = int(Window)
+    Half = int(FrameSize / 2)
+    Buffer = np.zeros(Half)  # the zero padding in front of the signal
+    Start = 1  # first sample of the next frame in Buffer
+    Count = 0
+    Emitted = 0
+    BatchSize = max(1, MaxBatchPoints // FrameSize)
+    Blocks = iter(Blocks)
+    while True:
+        Block = next(Blocks, None)
+        if Block is None:  # the zero padding behind the signal, and the last frames
+            Block = np.zeros(Half + 1)
+            FrameEnd = Count // StepPoints + 1
+        else:
+            Count = Count + len(Block)
+            FrameEnd = None
+        Buffer = np.concatenate((Buffer[Start:], Block))
+        Start = 0
+        if len(Buffer) >= FrameSize:
+            Frames = sliding_window_view(Buffer, FrameSize)[::StepPoints]
+            if FrameEnd is not None:
+                Frames = Frames[:max(FrameEnd - Emitted, 0)]
+            for i in range(0, len(Frames), BatchSize):
+                yield FramesIF(Frames[i:i + BatchSize], Fs, NFFT)
+            Emitted = Emitted + len(Frames)
+            Start = len(Frames) * StepPoints
+        if FrameEnd is not None:
+            return
+
+
+# ######## Sliding DFT
+# AccurateSTFT computes every window from scratch, FrameSize samples per bin and frame. When the
+# window is a whole number of steps, FrameSize = Blocks * StepPoints, a frame is the sum of the
+# spectra of its Blocks step-long blocks, block p shifted by p * StepPoints samples, so the bins of
+# Band can be slid along the signal instead: each new step costs the DFT of one block on those bins
+# (StepPoints samples per bin) and the sum of Blocks block spectra, the samples leaving the window
+# are the block dropped from the sum. Summing the block spectra again for every frame, instead of
+# updating the last frame, keeps the rounding from accumulating along the signal.
+# The peak and its three-point correction are those of FramesIF. Parseval bounds every bin outside
+# Band (sum of |X|^2 over the NFFT bins is NFFT * sum(x^2), each half spectrum bin but 0 appears twice),
+# so the band peak is kept only where it is certainly the peak of the whole half spectrum; the other
+# frames, e.g. all zero padding or noise dominated, are given to FramesIF. The result is that of
+# AccurateSTFT up to rounding.
+SlidingBand = (99.5, 100.5)  # Hz, around the 100 Hz flicker of the bandpassed signal
+
+
+class SlidingDFT:
+    def __init__(self, Window, StepPoints, Fs, NFFT, Band=SlidingBand):
+        FrameSize = int(Window)
+        if FrameSize % StepPoints != 0 or FrameSize % 2 != 0:
+            raise ValueError('the sliding DFT needs an even window of a whole number of steps')
+        self.StepPoints = StepPoints
+        self.Blocks = FrameSize // StepPoints
+        self.Fs = Fs
+        self.NFFT = NFFT
+        # bins of Band, with one extra bin on each side for the correction
+        LowBin = max(int(np.floor(Band[0] * NFFT / Fs)), 2)
+        HighBin = min(int(np.ceil(Band[1] * NFFT / Fs)), int(NFFT / 2) - 2)
+        self.FirstBin = LowBin - 1
+        Bins = np.arange(LowBin - 1, HighBin + 2)
+        Angle = 2 * np.pi / NFFT * ((np.arange(StepPoints)[:, None] * Bins[None, :]) % NFFT)
+        self.Cos = np.cos(Angle)
+        self.Sin = np.sin(Angle)
+        self.Shift = np.exp(-2j * np.pi / NFFT * ((np.arange(self.Blocks)[:, None] * StepPoints * Bins[None, :]) % NFFT))
+        self.Pending = np.empty(0)
+        # the last Blocks - 1 blocks: samples, spectra, sums and sums of squares
+        self.Samples = np.empty((0, StepPoints))
+        self.Spectra = np.empty((0, len(Bins)), dtype=complex)
+        self.Sums = np.empty(0)
+        self.Squares = np.empty(0)
+        self.Fallbacks = 0  # frames given to FramesIF
+
+    # instantaneous frequencies of the frames completed by Samples
+    def push(self, Samples):
+        Data = np.concatenate((self.Pending, Samples))
+        Count = len(Data) // self.StepPoints
+        self.Pending = Data[Count * self.StepPoints:]
+        if Count == 0:
+            return np.empty(0)
+        New = Data[:Count * self.StepPoints].reshape(Count, self.StepPoints)
+        Samples = np.concatenate((self.Samples, New))
+        Spectra = np.concatenate((self.Spectra, New @ self.Cos - 1j * (New @ self.Sin)))
+        Sums = np.concatenate((self.Sums, New.sum(axis=1)))
+        Squares = np.concatenate((self.Squares, np.einsum('ij,ij->i', New, New)))
+        Keep = self.Blocks - 1
+        Frames = len(Samples) - Keep
+        Start = max(Frames, 0)
+        self.Samples, self.Spectra, self.Sums, self.Squares = Samples[Start:], Spectra[Start:], Sums[Start:], Squares[Start:]
+        if Frames <= 0:
+            return np.empty(0)
+
+        Spectrum = Spectra[:Frames] * self.Shift[0]
+        for p in range(1, self.Blocks):
+            Spectrum += Spectra[p:p + Frames] * self.Shift[p]
+        FrameSum = sliding_window_view(Sums, self.Blocks).sum(axis=1)
+        FrameEnergy = sliding_window_view(Squares, self.Blocks).sum(axis=1)
+
+        Power = np.abs(Spectrum) ** 2
+        PeakLoc = np.argmax(Power[:, 1:-1], axis=1) + 1
+        Rows = np.arange(Frames)
+        PeakPower = Power[Rows, PeakLoc]
+        Outside = (self.NFFT * FrameEnergy - FrameSum ** 2 - 2 * Power.sum(axis=1)) / 2
+        Certain = PeakPower > np.maximum(np.maximum(Outside, FrameSum ** 2), np.maximum(Power[:, 0], Power[:, -1])) * (1 + 1e-9)
+
+        ValueLeft = Spectrum[Rows, PeakLoc - 1]
+        ValueCenter = Spectrum[Rows, PeakLoc]
+        ValueRight = Spectrum[Rows, PeakLoc + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            CorrectionCoef = -((ValueRight - ValueLeft) / (2 * ValueCenter - ValueRight - ValueLeft)).real
+        IF = (self.FirstBin + PeakLoc + CorrectionCoef - 1) * self.Fs / self.NFFT
+        Uncertain = np.flatnonzero(~Certain)
+        if len(Uncertain) > 0:
+            Rest = sliding_window_view(Samples, (self.Blocks, self.StepPoints))[Uncertain, 0].reshape(len(Uncertain), -1)
+            IF[Uncertain] = FramesIF(Rest, self.Fs, self.NFFT)
+            self.Fallbacks = self.Fallbacks + len(Uncertain)
+        return IF
+
+
+def SlidingSTFT(Signal, Window, StepPoints, Fs, NFFT, Band=SlidingBand, Progress=None):
+    # AccurateSTFT by the sliding DFT: the same zero padding, in front of the signal then behind it
+    Half = int(int(Window) / 2)
+    Sliding = SlidingDFT(Window, StepPoints, Fs, NFFT, Band)
+    Signal = np.asarray(Signal, dtype=np.float64)
+    IF0 = [Sliding.push(np.zeros(Half - 1))]
+    for i in range(0, len(Signal), MaxBatchPoints):
+        IF0.append(Sliding.push(Signal[i:i + MaxBatchPoints]))
+        if Progress is not None:
+            Progress(np.concatenate(IF0), len(Signal) // StepPoints + 1)
+    IF0.append(Sliding.push(np.zeros(Half + 1)))
+    return np.concatenate(IF0)
+
+
+def SlidingSTFTBlocks(Blocks, Window, StepPoints, Fs, NFFT, Band=SlidingBand):
+    # AccurateSTFTBlocks by the sliding DFT
+    Half = int(int(Window) / 2)
+    Sliding = SlidingDFT(Window, StepPoints, Fs, NFFT, Band)
+    Sliding.push(np.zeros(Half - 1))
+    for Block in Blocks:
+        yield Sliding.push(Block)
+    yield Sliding.push(np.zeros(Half + 1))
@@ -1,150 +1,193 @@
 import numpy as np
-import os
-
-class Event_txt_loader:
-    def __init__(self, path):
-        self.events = np.loadtxt(path)
-        self.timestamp = self.events[:, 0]
-        self.xpos = np.int32(self.events[:, 1])
-        self.ypos = np.int32(self.events[:, 2])
-        self.polarity = np.uint32(self.events[:, 3])
-
-        self.size = len(self.timestamp)
-        h, w = 480, 640
-        self.shape = (h, w) # h, w
-
-        self.begin_time = self.timestamp[0]
-        self.final_time = self.timestamp[-1]
-        self.delta_t_idx = 0
-        self.done = False
-
-    def load_delta_t(self, delta_t):
-
-        current_time = self.timestamp[self.delta_t_idx]     # the current timestamp
-        if self.done or current_time + delta_t > self.final_time:
-            self.done = True
-            return np.empty((0,), dtype=np.uint32)
-
-        finish_time = current_time + delta_t
-        finish_idx = np.where(self.timestamp < finish_time)[0][-1]
-
-        events = dict()
-        events['t'] = self.timestamp[self.delta_t_idx:finish_idx+1]
-        events['x'] = self.xpos[self.delta_t_idx:finish_idx+1]
-        events['y'] = self.ypos[self.delta_t_idx:finish_idx+1]
-        events['p'] = self.polarity[self.delta_t_idx:finish_idx+1]
-        events['size'] = finish_idx - self.delta_t_idx + 1
-        self.delta_t_idx = finish_idx + 1
-        return events
-
-    # For a given timestamp, read the events from the previous time
-    def load_last_delta_t(self, time, delta_t):
-        # assert time <= self.final_time, 'time is out of range! Final time is {}'.format(self.final_time)
-        begin_time = time - delta_t
-        if begin_time < self.begin_time:
-            begin_time = self.begin_time
-        if time > self.final_time:
-            finish_time = self.final_time
-        else:
-            finish_time = time
-        print(begin_time, finish_time)
-        if finish_time <= begin_time:
-            events = dict()
-            events['size'] = 0
-            return events
-
-        begin_idx = np.where(self.timestamp >= begin_time)[0][0]
-        finish_idx = np.where(self.timestamp <= finish_time)[0][-1]
-
-        print(begin_idx, finish_idx)
-        events = dict()
-        events['t'] = self.timestamp[begin_idx:finish_idx + 1]
-        events['x'] = self.xpos[begin_idx:finish_idx + 1]
-        events['y'] = self.ypos[begin_idx:finish_idx + 1]
-        events['p'] = self.polarity[begin_idx:finish_idx + 1]
-        events['size'] = finish_idx - begin_idx + 1
-        return events
-
-
-    def load_t(self, delta_t):
-        # if delta_t < 1:
-        #     raise ValueError("load_delta_t(): delta_t must be at least 1 micro-second: {}".format(delta_t))
-
-        current_time = self.timestamp[self.delta_t_idx]     # 当前的时间戳
-        if self.done or current_time + delta_t > self.final_time:
-            self.done = True
-            return np.empty((0,), dtype=np.uint32)
-
-        finish_time = current_time + delta_t
-        finish_idx = np.where(self.timestamp <= finish_time)[0][-1]
-        sampling_time_finish = self.timestamp[finish_idx]
-        sampling_begin_time_index = finish_idx
-        while True:
-            if(self.timestamp[sampling_begin_time_index]==sampling_time_finish):
-                sampling_begin_time_index = sampling_begin_time_index -1
-            else:
-                break
-        events = dict()
-        events['t'] = self.timestamp[sampling_begin_time_index+1:finish_idx+1]
-        events['x'] = self.xpos[sampling_begin_time_index+1:finish_idx+1]
-        events['y'] = self.ypos[sampling_begin_time_index+1:finish_idx+1]
-        events['p'] = self.polarity[sampling_begin_time_index+1:finish_idx+1]
-        self.delta_t_idx = finish_idx + 1
-        return events
-
-    def files_load_t(self, delta_t, current_time):
-        # if delta_t < 1:
-        #     raise ValueError("load_delta_t(): delta_t must be at least 1 micro-second: {}".format(delta_t))
-
-        if self.done or current_time + delta_t > self.final_time:
-            self.done = True
-            return np.empty((0,), dtype=np.uint32),current_time
-
-        finish_time = current_time + delta_t
-        if finish_time < self.begin_time:
-            finish_time = self.begin_time
-        finish_idx = np.where(self.timestamp <= finish_time)[0][-1]
-        sampling_time_finish = self.timestamp[finish_idx]
-        sampling_begin_time_index = finish_idx
-        while True:
-            if (self.timestamp[sampling_begin_time_index] == sampling_time_finish):
-                sampling_begin_time_index = sampling_begin_time_index - 1
-            else:
-                break
-        # print(self.delta_t_idx, finish_idx)
-        events = dict()
-        events['t'] = self.timestamp[sampling_begin_time_index + 1:finish_idx + 1]
-        events['x'] = self.xpos[sampling_begin_time_index + 1:finish_idx + 1]
-        events['y'] = self.ypos[sampling_begin_time_index + 1:finish_idx + 1]
-        events['p'] = self.polarity[sampling_begin_time_index + 1:finish_idx + 1]
-        self.delta_t_idx = finish_idx + 1
-        current_time = finish_time
-        return events, current_time
-
+import sys
+from scipy import signal
+from os.path import dirname, abspath
+sys.path.append(dirname(dirname(abspath(__file__))) + '/Event_Process')
+from event_stream import EventStream
+from read_txt import Event_txt_loader
+
+
+######## polarity-majority sampler #########
+# Sample k (k >= 1) is taken at begin_time + k/fps: the majority polarity of the events sharing the
+# latest timestamp not after the sample time, ties giving 0 as np.argmax(np.bincount(p)) does.
+# Packets are pushed in time order; each one is reduced to per-timestamp polarity counts with a single
+# bincount, and the group of its last timestamp is carried over, since the next packet may extend it.
+class PolaritySampler:
+    def __init__(self, fps):
+        self.delta_t = 1e6 / fps
+        self.begin_time = None
+        self.k = 1
+        self.last_time = None
+        self.last_count = np.zeros(2, dtype=np.int64)
+
+    def sample_times(self, k_end):
+        return (self.begin_time + np.arange(self.k, k_end) * self.delta_t).astype(np.int64)
+
+    def push(self, t, p):
+        if len(t) == 0:
+            return np.empty((0,), dtype=np.uint8)
+        t = np.asarray(t)
+        p = np.asarray(p)
+        if self.begin_time is None:
+            self.begin_time = int(t[0])
+
+        # counts of (negative, positive) events for every distinct timestamp
+        new_group = np.empty(len(t), dtype=np.int64)
+        new_group[0] = 1
+        np.not_equal(t[1:], t[:-1], out=new_group[1:])
+        group = np.cumsum(new_group) - 1
+        group_time = t[new_group.astype(bool)]
+        if self.last_time is not None and group_time[0] != self.last_time:
+            group = group + 1
+            group_time = np.concatenate(([self.last_time], group_time))
+        count = np.bincount(group * 2 + p, minlength=2 * len(group_time)).reshape(-1, 2)
+        if self.last_time is not None:
+            count[0] += self.last_count
+
+        # samples before the last timestamp are complete
+        k_end = int(np.ceil((group_time[-1] - self.begin_time) / self.delta_t)) + 1
+        finish_time = self.sample_times(k_end)
+        finish_time = finish_time[:np.searchsorted(finish_time, group_time[-1], 'left')]
+        idx = np.searchsorted(group_time, finish_time, 'right') - 1
+        data = (count[idx, 1] > count[idx, 0]).astype(np.uint8)
+
+        self.k = self.k + len(finish_time)
+        self.last_time = int(group_time[-1])
+        self.last_count = count[-1]
+        return data
+
+    # the remaining samples up to the final timestamp all fall on the carried group
+    def finish(self):
+        if self.last_time is None:
+            return np.empty((0,), dtype=np.uint8)
+        k_end = int((self.last_time - self.begin_time) / self.delta_t) + 2
+        finish_time = self.sample_times(k_end)
+        size = np.searchsorted(finish_time, self.last_time, 'right')
+        self.k = self.k + size
+        return np.full(size, self.last_count[1] > self.last_count[0], dtype=np.uint8)
 
 
 ######## events_files#########
-def event_files_sampling(source_path, fps):
+# progress(done, total) is called after every events file (packet). counts['events'], when counts is
+# given, is increased by the number of events read (the same for aedat_sampling and tiled_sampling).
+def event_files_sampling(source_path, fps, progress=None, counts=None):
+    stream = EventStream(source_path)
+    sampler = PolaritySampler(fps)
     data = []
-    path = source_path
-    path_list = os.listdir(path)
-    path_list.sort(key=lambda x: int(x[6:-4]))
-    j = 0
-    for i in path_list:
-        fliename = path + '/' + i
-        events_loader = Event_txt_loader(fliename)
-        if j == 0:
-            current_time = events_loader.begin_time  #####  select first current_time
-            j = 1
-        while True:
-            events, current_time = events_loader.files_load_t(1/fps, current_time)
-            polarity = []
-            if events_loader.done:
-                break
-            x, y, t, p = events['x'], events['y'], events['t'], events['p']
-            try:
-                data.append(np.argmax(np.bincount(p)))
-            except Exception:
-                data.append(data[-1])
-    return data
-
+    for i, (t, x, y, p) in enumerate(stream.chunks()):
+        data.append(sampler.push(t, p))
+        if counts is not None:
+            counts['events'] = counts.get('events', 0) + len(t)
+        if progress is not None:
+            progress(i + 1, len(stream))
+    data.append(sampler.finish())
+    # float, as filtfilt's edge extension (2 * x[0] - x[1:]) is computed in the dtype of its input
+    return np.concatenate(data).astype(np.float64)
+
+
+######## aedat4 file, sampled packet by packet without unpacking #########
+def aedat_packets(file_path):
+    from dv import AedatFile
+    with AedatFile(file_path) as f:
+        for e in f['events'].numpy():
+            yield e['timestamp'], e['polarity']
+
+
+# progress(done, None) is called after every packet, their number is not known in advance
+def aedat_sampling(file_path, fps, progress=None, counts=None):
+    sampler = PolaritySampler(fps)
+    data = []
+    for t, p in aedat_packets(file_path):
+        data.append(sampler.push(t, p))
+        if counts is not None:
+            counts['events'] = counts.get('events', 0) + len(t)
+        if progress is not None:
+            progress(len(data), None)
+    data.append(sampler.finish())
+    return np.concatenate(data).astype(np.float64)
+
+
+######## tiled extraction #########
+# The sensor is split into rows x cols tiles and every tile gets its own series with one value per 1/fps
+# bin, bin k covering [begin_time + k/fps, begin_time + (k+1)/fps): the majority polarity of the bin's
+# events ('polarity', ties giving 0, bins without events holding the previous value) or their number
+# ('rate'). Each packet is reduced with a single bincount over (tile, bin, polarity); the bin of its
+# last event is carried over, since the next packet may add to it.
+class TiledSampler:
+    def __init__(self, fps, begin_time, bins, rows=4, cols=4, mode='polarity', height=480, width=640):
+        self.fps = fps
+        self.begin_time = begin_time
+        self.rows = rows
+        self.cols = cols
+        self.tiles = rows * cols
+        self.mode = mode
+        self.height = height
+        self.width = width
+        self.series = np.zeros((self.tiles, bins), dtype=np.float32)
+        self.last_bin = 0
+        self.last_count = np.zeros((self.tiles, 2), dtype=np.int64)
+        self.last_value = np.zeros(self.tiles, dtype=np.float32)
+
+    def push(self, t, x, y, p):
+        if len(t) == 0:
+            return
+        bins = len(self.series[0])
+        b = np.minimum((np.asarray(t, dtype=np.int64) - self.begin_time) * self.fps // 1000000, bins - 1)
+        tile = (np.asarray(y, dtype=np.int64) * self.rows // self.height) * self.cols + np.asarray(x, dtype=np.int64) * self.cols // self.width
+        first, last = self.last_bin, int(b[-1])
+        span = last - first + 1
+        count = np.bincount((tile * span + (b - first)) * 2 + p, minlength=self.tiles * span * 2).reshape(self.tiles, span, 2)
+        count[:, 0] += self.last_count
+        self.finalize(first, count[:, :-1])
+        self.last_bin = last
+        self.last_count = count[:, -1]
+
+    def finalize(self, first, count):
+        if count.shape[1] == 0:
+            return
+        if self.mode == 'rate':
+            self.series[:, first:first + count.shape[1]] = count.sum(axis=2)
+            return
+        # bins without events hold the previous value of the tile
+        value = np.concatenate((self.last_value[:, None], (count[:, :, 1] > count[:, :, 0]).astype(np.float32)), axis=1)
+        filled = np.concatenate((np.ones((self.tiles, 1), dtype=bool), count.sum(axis=2) > 0), axis=1)
+        hold = np.maximum.accumulate(np.where(filled, np.arange(filled.shape[1]), 0), axis=1)
+        value = np.take_along_axis(value, hold, axis=1)[:, 1:]
+        self.series[:, first:first + count.shape[1]] = value
+        self.last_value = value[:, -1]
+
+    def finish(self):
+        self.finalize(self.last_bin, self.last_count[:, None, :])
+        return self.series
+
+
+# (rows * cols, bins) series of an 'events' folder, progress(done, total) is called after every events file.
+# The last, incomplete bin is dropped so that there are as many bins as event_files_sampling samples.
+def tiled_sampling(source_path, fps, rows=4, cols=4, mode='polarity', progress=None, counts=None):
+    stream = EventStream(source_path)
+    bins = int((stream.final_time - stream.begin_time) * fps // 1000000)
+    sampler = TiledSampler(fps, stream.begin_time, bins + 1, rows, cols, mode)
+    for i, (t, x, y, p) in enumerate(stream.chunks()):
+        sampler.push(t, x, y, p)
+        if counts is not None:
+            counts['events'] = counts.get('events', 0) + len(t)
+        if progress is not None:
+            progress(i + 1, len(stream))
+    return sampler.finish()[:, :bins]
+
+
+# Power in the 98-102 Hz band over the median power of 90-110 Hz outside it, for every tile
+def tile_snr(series, fps, band=(98, 102), noise=(90, 110)):
+    frequency, power = signal.welch(series, fs=fps, nperseg=min(len(series[0]), 4 * int(fps)), axis=1)
+    in_band = (frequency >= band[0]) & (frequency <= band[1])
+    out_band = (frequency >= noise[0]) & (frequency <= noise[1]) & ~in_band
+    return power[:, in_band].mean(axis=1) / np.maximum(np.median(power[:, out_band], axis=1), 1e-20)
+
+
+# SNR-weighted sum of the best tiles, each normalised to unit variance; top=1 keeps the best tile alone
+def combine_tiles(series, snr, top=4):
+    best = np.argsort(snr)[::-1][:top]
+    weights = snr[best] / snr[best].sum()
+    tiles = series[best] - series[best].mean(axis=1, keepdims=True)
+    tiles = tiles / np.maximum(tiles.std(axis=1, keepdims=True), 1e-12)
+    return weights @ tiles
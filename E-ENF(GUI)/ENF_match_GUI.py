@@ -1,16 +1,16 @@
+import queue
+import threading
 import tkinter as tk
+from tkinter import ttk
 from tkinter.filedialog import askdirectory
-import soundfile as sf
-import numpy as np
-from scipy import signal
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from TDMF import TDMF
-from find_reference_wav_filename import date_wav_filename
-from AccurateSTFT import AccurateSTFT
-from scipy.stats import pearsonr
-from DV_data import event_files_sampling
+from find_reference_wav_filename import parse_recording_name
+from reference_archive import ReferenceArchive
+from ENF_pipeline import estimate_ENF, reference_ENF, compare_ENF, PipelineCancelled
+from metrics import RunMetrics, append_record, format_record, profiled
+from track_cache import TrackCache, default_cache_folder
 # #####################################################
 # ################ Generate task
 
@@ -26,78 +26,144 @@ def Select_reference_path():
     path.set(folernames)
 
 
-# ###########################################start program button############################
-
-def start_program_button():
-
-    ConstFs = 1000
-    AWindowLength = 16 * ConstFs
-    AStepSize = ConstFs
-    NFFT = 200 * ConstFs
-
-    # #####################################################
-    file_path = filenames
-
-    FILENAME = filenames.split('/')[-2]
-    ENF_Year = FILENAME[7:11]
-    ENF_Month = FILENAME[12:14]
-    ENF_date_Begin = ENF_date_End = FILENAME[15:17]
-    ENF_Hour_Begin = FILENAME[18:20]
-    ENF_Hour_End = str(int(FILENAME[18:20]) + 1)
-    ENF_second = int(FILENAME[21:23]) * 60 + int(FILENAME[24:26])
-    Ref_filename = date_wav_filename(ENF_Year, ENF_Month, ENF_date_Begin, ENF_date_End, ENF_Hour_Begin, ENF_Hour_End)
-    Reference = folernames + '/' + Ref_filename + '.wav'
-    data_ref, frequency = sf.read(Reference)
-
-
-    Use_data = event_files_sampling(file_path, ConstFs)
-
+# ################ Background worker
+# The pipeline runs in one worker thread fed by job_queue, so the window stays responsive and several
+# recordings can be queued with Start. The worker only posts messages to message_queue; the widgets and
+# the plot are updated from the Tk main thread by poll_messages, which window.after calls every 100 ms.
+# Each job records its stage metrics, the EPS export included, shown in the Metrics panel; 'Log' appends
+# them to MetricsFile, 'Memory' traces the peak memory of every stage (slower) and 'Profile' dumps
+# <recording>.prof cProfile stats of the worker's stages. ENF tracks are cached next to the recordings
+# (track_cache), so running a recording again only reads its track back.
+job_queue = queue.Queue()
+message_queue = queue.Queue()
+cancel_event = threading.Event()
+StageNames = {'sampling': 'Sampling events file', 'bandpass': 'Bandpass filter', 'stft': 'STFT frame',
+              'tdmf': 'TDMF', 'reference': 'Reference ENF', 'cache': 'Cache'}
+MetricsFile = 'ENF_metrics.jsonl'
+
+
+def run_job(file_path, reference_path, profile=False, log=False, trace_memory=False, use_cache=True):
+    FILENAME = file_path.split('/')[-2]
+
+    def progress(stage, done, total, partial=None):
+        if cancel_event.is_set():
+            raise PipelineCancelled()
+        message_queue.put(('progress', FILENAME, stage, done, total, partial))
+
+    metrics = RunMetrics(FILENAME, trace_memory)
+    try:
+        with profiled(FILENAME + '.prof' if profile else None):
+            Record_begin = parse_recording_name(FILENAME)
+            Cache = TrackCache(default_cache_folder(file_path)) if use_cache else None
+            IF = estimate_ENF(file_path, metrics, progress=progress, Cache=Cache)
+
+            ### Reference ENF, read from the archive whatever hours, days or months the recording spans
+            with metrics.stage('reference') as stage:
+                progress('reference', 0, 1)
+                Archive = ReferenceArchive(reference_path, 16, 1, 200)
+                IF_ref = reference_ENF(Archive, Record_begin, len(IF))
+                stage['samples'] = len(IF_ref)
+            with metrics.stage('compare') as stage:
+                corr, MAE = compare_ENF(IF, IF_ref)
+                stage['samples'] = len(IF)
+    except BaseException:
+        metrics.finish()
+        raise
+    metrics.info.update(corr=corr, MAE=MAE)
+    message_queue.put(('result', FILENAME, IF, IF_ref, corr, MAE, metrics, log))
+
+
+def worker():
+    while True:
+        job = job_queue.get()
+        file_path = job[0]
+        cancel_event.clear()
+        try:
+            run_job(*job)
+        except PipelineCancelled:
+            message_queue.put(('cancelled', file_path))
+        except Exception as error:
+            message_queue.put(('error', file_path, '%s: %s' % (type(error).__name__, error)))
 
-    ##### 100Hz
-    b, a = signal.butter(4, [(98 * 2 / ConstFs), (102 * 2 / ConstFs)], 'bandpass')   #6
-    data_after_fir = signal.filtfilt(b, a, Use_data)
-    IFtest1 = np.array(AccurateSTFT(data_after_fir, AWindowLength, AStepSize, ConstFs, NFFT))
-    IFtest1 = np.array(TDMF(IFtest1, 21, 0.02))
 
+# ###########################################start program button############################
 
-    IF = IFtest1 / 2
-
-
-    if len(IF) + ENF_second > 3600:
-        Ref_filename2 = date_wav_filename(ENF_Year, ENF_Month, ENF_date_Begin, ENF_date_End,
-                                          str(int(ENF_Hour_Begin) + 1), str(int(ENF_Hour_End) + 1))
-        Reference2 = folernames + '/' + Ref_filename2 + '.wav'
-        data_ref2, frequency = sf.read(Reference2)
-        data_ref = np.append(data_ref, data_ref2)
-
-    ### Reference ENF
-    ConstFs2 = frequency
-    AWindowLength2 = 16 * ConstFs2
-    AStepSize2 = ConstFs2
-    NFFT2 = 200 * ConstFs2
-    IF_ref_total = AccurateSTFT(data_ref, AWindowLength2, AStepSize2, ConstFs2, NFFT2)
-
-    IF_ref = IF_ref_total[ENF_second:ENF_second + len(IF)]
+def start_program_button():
+    job_queue.put((filenames, folernames, profile_run.get(), log_metrics.get(), trace_memory.get(), use_cache.get()))
+    status.set('Queued %s (%d waiting)' % (filenames, job_queue.qsize()))
 
-    corr = pearsonr(IF, IF_ref)[0] * 100
-    MAE = np.sum(np.absolute(IF - IF_ref)) / len(IF)
 
-    titlename='Similiraty:  ' + '%0.2f' % corr + '%' + '    ' + 'MAE: ' + '%f' %MAE
+def cancel_program_button():
+    while True:
+        try:
+            job_queue.get_nowait()
+        except queue.Empty:
+            break
+    cancel_event.set()
 
 
-    # ####################### Drawing
-    matplotlib.use('TkAgg')
-    fig = plt.Figure(figsize=(5, 4), dpi=80)
-    draw_set = FigureCanvasTkAgg(fig, master=window)
-    ax = fig.add_subplot(111)
+# ####################### Drawing
+def draw_ENF(IF, IF_ref=None, titlename=''):
+    ax.clear()
     ax.plot(IF, label='record')
     ax.legend(loc='upper right')
-    ax.plot(IF_ref, label='reference')
-    ax.legend(loc='upper right')
+    if IF_ref is not None:
+        ax.plot(IF_ref, label='reference')
+        ax.legend(loc='upper right')
     ax.set_ylim(49.95, 50.05)
     ax.set(title=titlename, ylabel='Frequency (Hz)', xlabel='Time (s)')
-    fig.savefig(FILENAME + '.eps',dpi=80,format='eps',bbox_inches = 'tight')
-    draw_set.get_tk_widget().place(x=100, y=100, height=420, width=480)
+    draw_set.draw_idle()
+
+
+def poll_messages():
+    partial = None
+    while True:
+        try:
+            message = message_queue.get_nowait()
+        except queue.Empty:
+            break
+        if message[0] == 'progress':
+            FILENAME, stage, done, total, IF = message[1:]
+            count = '%d' % done if total is None else '%d/%d' % (done, total)
+            status.set('%s: %s %s (%d waiting)' % (FILENAME, StageNames[stage], count, job_queue.qsize()))
+            if total is not None:
+                progress_bar.configure(maximum=max(total, 1), value=done)
+            if IF is not None:
+                partial = (FILENAME, IF)
+        elif message[0] == 'result':
+            FILENAME, IF, IF_ref, corr, MAE, metrics, log = message[1:]
+            partial = None
+            titlename='Similiraty:  ' + '%0.2f' % corr + '%' + '    ' + 'MAE: ' + '%f' %MAE
+            with metrics.stage('export'):
+                draw_ENF(IF, IF_ref, titlename)
+                fig.savefig(FILENAME + '.eps',dpi=80,format='eps',bbox_inches = 'tight')
+            record = metrics.finish()
+            if log:
+                append_record(MetricsFile, record)
+            metrics_text.configure(state='normal')
+            metrics_text.delete('1.0', 'end')
+            metrics_text.insert('end', format_record(record))
+            metrics_text.configure(state='disabled')
+            status.set('%s done (%d waiting)' % (FILENAME, job_queue.qsize()))
+        elif message[0] == 'cancelled':
+            status.set('Cancelled %s' % message[1])
+        else:
+            status.set('Failed %s, %s' % (message[1], message[2]))
+    if partial is not None:
+        draw_ENF(partial[1], titlename=partial[0] + ' (in progress)')
+    window.after(100, poll_messages)
+
+
+# Metrics panel below the plot, collapsed by default
+def toggle_metrics():
+    if metrics_text.winfo_ismapped():
+        metrics_text.place_forget()
+        metrics_btn.configure(text='Metrics +')
+        window.geometry('680x550')
+    else:
+        window.geometry('680x730')
+        metrics_text.place(x=15, y=555, width=650, height=165)
+        metrics_btn.configure(text='Metrics -')
 
 
 # ####################################################  window
@@ -129,4 +195,33 @@ folder.place(x=170, y=58, width=420)
 # Program run button
 start_pro = tk.Button(window, text="Start", image=pixelVirtual, height = 50, width = 50, compound="c", command=start_program_button)
 start_pro.place(x=600, y=22)
+
+cancel_pro = tk.Button(window, text="Cancel", image=pixelVirtual, height = 20, width = 50, compound="c", command=cancel_program_button)
+cancel_pro.place(x=600, y=82)
+
+profile_run = tk.BooleanVar(value=False)
+tk.Checkbutton(window, text='Profile', variable=profile_run).place(x=595, y=120)
+log_metrics = tk.BooleanVar(value=False)
+tk.Checkbutton(window, text='Log', variable=log_metrics).place(x=595, y=145)
+trace_memory = tk.BooleanVar(value=False)
+tk.Checkbutton(window, text='Memory', variable=trace_memory).place(x=595, y=170)
+use_cache = tk.BooleanVar(value=True)
+tk.Checkbutton(window, text='Cache', variable=use_cache).place(x=595, y=195)
+metrics_btn = tk.Button(window, text="Metrics +", image=pixelVirtual, height = 20, width = 60, compound="c", command=toggle_metrics)
+metrics_btn.place(x=595, y=515)
+metrics_text = tk.Text(window, font=('Courier', 9), state='disabled')
+
+status = tk.StringVar()
+tk.Label(window, textvariable=status, anchor='w').place(x=15, y=85, width=570)
+progress_bar = ttk.Progressbar(window, mode='determinate')
+progress_bar.place(x=100, y=525, width=480)
+
+matplotlib.use('TkAgg')
+fig = plt.Figure(figsize=(5, 4), dpi=80)
+draw_set = FigureCanvasTkAgg(fig, master=window)
+ax = fig.add_subplot(111)
+draw_set.get_tk_widget().place(x=100, y=110, height=410, width=480)
+
+threading.Thread(target=worker, daemon=True).start()
+window.after(100, poll_messages)
 window.mainloop()
@@ -0,0 +1,244 @@
+import os
+from datetime import timedelta
+import numpy as np
+from scipy import signal
+from scipy.stats import pearsonr
+from TDMF import TDMF
+from AccurateSTFT import AccurateSTFT, AccurateSTFTBlocks, SlidingSTFT, SlidingSTFTBlocks
+from chunked_filter import ChunkedFiltFilt
+from DV_data import event_files_sampling, aedat_sampling, aedat_packets, tiled_sampling, tile_snr, combine_tiles, \
+    PolaritySampler, EventStream
+from find_reference_wav_filename import parse_recording_name
+from reference_archive import ReferenceArchive
+from blind_search import AllLagScores
+from metrics import RunMetrics, profiled
+from track_cache import TrackCache, source_stamp
+
+# ######## E-ENF pipeline
+# The processing behind the GUI's Start button without any tkinter state, so that it can be run
+# headless (batch_ENF.py) or from the GUI: polarity sampling, 98-102 Hz bandpass, AccurateSTFT and
+# TDMF on one recording, then comparison with the reference archive.
+ConstFs = 1000
+AWindowLength = 16 * ConstFs
+AStepSize = ConstFs
+NFFT = 200 * ConstFs
+Band = (98, 102)
+FilterOrder = 4
+TDMFOrder = 21
+TDMFThreshold = 0.02
+# STFT backends: 'stft' transforms every window (AccurateSTFT), 'sliding' slides the DFT bins around
+# 100 Hz along the signal (SlidingSTFT), same frequencies up to rounding
+Estimators = ('stft', 'sliding')
+# part of the track cache keys, to be increased by any change of the sampling, filter, STFT or TDMF
+# results so that tracks cached by older code are not read back
+CacheVersion = 2
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+# Estimated ENF of an 'events' folder or of an aedat4 file read directly, one value per second. Every
+# stage is recorded in metrics (a RunMetrics): sampling, bandpass, stft and tdmf.
+# progress(stage, done, total, partial) is called after every events file and every STFT batch, partial
+# being the ENF estimated so far (before TDMF) during the 'stft' stage; it may raise PipelineCancelled to stop.
+# The number of packets of an aedat4 file is not known in advance, its 'sampling' total is None.
+# With Tiles=(rows, cols) an 'events' folder is sampled per tile and the TopTiles tiles with the best
+# 100 Hz SNR are combined, weighted by their SNR, instead of sampling the whole sensor at once.
+# With Chunked=True the whole-sensor signal is sampled, filtered and transformed block by block (see chunked_IF).
+# With a Cache (TrackCache) the ENF track, or else the sampled 1 kHz signal, of an earlier run with the
+# same event files and parameters is read back instead of being computed, and stored when it is not;
+# metrics.info['cache'] tells which ('IF', 'signal' or 'miss'). Estimator is one of Estimators.
+def estimate_ENF(events_path, metrics=None, progress=None, Tiles=None, TopTiles=4, Chunked=False, Cache=None,
+                 Estimator='stft'):
+    if metrics is None:
+        metrics = RunMetrics(events_path)
+    if progress is None:
+        progress = lambda stage, done, total, partial=None: None
+    if Chunked and Tiles is not None:
+        raise ValueError('tiled sampling ranks the tiles over the whole recording and cannot be chunked')
+    if Estimator not in Estimators:
+        raise ValueError('unknown estimator %r' % Estimator)
+    Keys = None
+    if Cache is not None:
+        with metrics.stage('cache'):
+            progress('cache', 0, 1)
+            Keys = cache_keys(events_path, Tiles, TopTiles, Chunked, Estimator)
+            Entry = Cache.load(Keys['IF'])
+        metrics.info['cache'] = 'miss'
+        if Entry is not None:
+            metrics.info['cache'] = 'IF'
+            return Entry['IF']
+
+    if Chunked:
+        IFtest1 = chunked_IF(events_path, metrics, progress, Estimator)
+    else:
+        IFtest1 = whole_IF(events_path, metrics, progress, Tiles, TopTiles, Cache, Keys, Estimator)
+
+    with metrics.stage('tdmf') as stage:
+        progress('tdmf', 0, 1)
+        IFtest1 = np.array(TDMF(IFtest1, TDMFOrder, TDMFThreshold))
+        stage['samples'] = len(IFtest1)
+    if Cache is not None:
+        with metrics.stage('cache'):
+            Cache.save(Keys['IF'], IF=IFtest1 / 2)
+    return IFtest1 / 2
+
+
+# Cache keys of the sampled signal and of the ENF track, each with every parameter its result depends on
+def cache_keys(events_path, Tiles, TopTiles, Chunked, Estimator='stft'):
+    source = source_stamp(events_path)
+    Sampling = dict(Version=CacheVersion, ConstFs=ConstFs, Tiles=Tiles, TopTiles=TopTiles if Tiles is not None else None)
+    Track = dict(Sampling, Band=Band, FilterOrder=FilterOrder, Chunked=Chunked, AWindowLength=AWindowLength,
+                 AStepSize=AStepSize, NFFT=NFFT, TDMFOrder=TDMFOrder, TDMFThreshold=TDMFThreshold, Estimator=Estimator)
+    return dict(signal=TrackCache.key('signal', source, Sampling), IF=TrackCache.key('IF', source, Track))
+
+
+def whole_IF(events_path, metrics, progress, Tiles, TopTiles, Cache=None, Keys=None, Estimator='stft'):
+    Use_data = None
+    if Cache is not None:
+        with metrics.stage('cache'):
+            Use_data = Cache.load_signal(Keys['signal'])
+        if Use_data is not None:
+            metrics.info['cache'] = 'signal'
+    if Use_data is None:
+        Use_data = sample_events(events_path, metrics, progress, Tiles, TopTiles)
+        if Cache is not None:
+            with metrics.stage('cache'):
+                Cache.save_signal(Keys['signal'], Use_data)
+
+    ##### 100Hz
+    with metrics.stage('bandpass') as stage:
+        progress('bandpass', 0, 1)
+        b, a = signal.butter(FilterOrder, [(Band[0] * 2 / ConstFs), (Band[1] * 2 / ConstFs)], 'bandpass')   #6
+        data_after_fir = signal.filtfilt(b, a, Use_data)
+        stage['samples'] = len(data_after_fir)
+
+    with metrics.stage('stft') as stage:
+        STFT = SlidingSTFT if Estimator == 'sliding' else AccurateSTFT
+        IFtest1 = np.array(STFT(data_after_fir, AWindowLength, AStepSize, ConstFs, NFFT,
+                                Progress=lambda IF, total: progress('stft', len(IF), total, IF / 2)))
+        stage['samples'] = len(data_after_fir)
+    return IFtest1
+
+
+def sample_events(events_path, metrics, progress, Tiles, TopTiles):
+    with metrics.stage('sampling') as stage:
+        sampling_progress = lambda done, total: progress('sampling', done, total)
+        if Tiles is not None:
+            if events_path.endswith('.aedat4'):
+                raise ValueError('tiled sampling needs an unpacked events folder')
+            series = tiled_sampling(events_path, ConstFs, Tiles[0], Tiles[1], 'polarity', sampling_progress, stage)
+            Use_data = combine_tiles(series, tile_snr(series, ConstFs), TopTiles)
+            del series
+        elif events_path.endswith('.aedat4'):
+            Use_data = aedat_sampling(events_path, ConstFs, sampling_progress, stage)
+        else:
+            Use_data = event_files_sampling(events_path, ConstFs, sampling_progress, stage)
+        stage['samples'] = len(Use_data)
+    return Use_data
+
+
+# Sampling, bandpass and STFT interleaved on every packet, so that memory does not grow with the
+# duration: the bandpass is a ChunkedFiltFilt of the same Butterworth filter in second-order sections
+# (zero phase, equal to filtfilt within about 1e-8) and AccurateSTFTBlocks transforms the frames each
+# filtered block completes (SlidingSTFTBlocks with Estimator='sliding'). Only the IF series, one value per
+# second, is kept whole.
+def chunked_IF(events_path, metrics, progress, Estimator='stft'):
+    if events_path.endswith('.aedat4'):
+        packets, total = aedat_packets(events_path), None
+    else:
+        stream = EventStream(events_path)
+        packets, total = ((t, p) for t, x, y, p in stream.chunks()), len(stream)
+    sos = signal.butter(FilterOrder, [(Band[0] * 2 / ConstFs), (Band[1] * 2 / ConstFs)], 'bandpass', output='sos')
+    Filter = ChunkedFiltFilt(sos)
+    sampler = PolaritySampler(ConstFs)
+
+    # runs inside the stft stage, whose time does not include these nested stages
+    def blocks():
+        done = 0
+        while True:
+            with metrics.stage('sampling') as stage:
+                packet = next(packets, None)
+                Use_data = sampler.finish() if packet is None else sampler.push(*packet)
+                stage['events'] = stage.get('events', 0) + (0 if packet is None else len(packet[0]))
+                stage['samples'] = stage.get('samples', 0) + len(Use_data)
+            with metrics.stage('bandpass') as stage:
+                data_after_fir = Filter.push(Use_data)
+                if packet is None:
+                    data_after_fir = np.concatenate((data_after_fir, Filter.finish()))
+                stage['samples'] = stage.get('samples', 0) + len(data_after_fir)
+            yield data_after_fir
+            if packet is None:
+                return
+            done = done + 1
+            progress('sampling', done, total)
+
+    IFtest1 = []
+    Frames = 0
+    with metrics.stage('stft') as stage:
+        STFTBlocks = SlidingSTFTBlocks if Estimator == 'sliding' else AccurateSTFTBlocks
+        for IF in STFTBlocks(blocks(), AWindowLength, AStepSize, ConstFs, NFFT):
+            IFtest1.append(IF)
+            Frames = Frames + len(IF)
+            progress('stft', Frames, None, np.concatenate(IFtest1) / 2)
+        stage['samples'] = metrics.stages['bandpass']['samples']
+    return np.concatenate(IFtest1) if IFtest1 else np.empty(0)
+
+
+# Reference ENF over the seconds of a recording, with MaxLag extra seconds on both sides
+def reference_ENF(Archive, Record_begin, Length, MaxLag=0):
+    return Archive.get_enf(Record_begin - timedelta(seconds=MaxLag), Record_begin + timedelta(seconds=Length + MaxLag))
+
+
+# Similarity (%) and MAE of an estimated ENF against the reference over the same seconds
+def compare_ENF(IF, IF_ref):
+    if np.isnan(IF_ref).any():
+        raise ValueError('no reference ENF for part of the recording')
+    corr = pearsonr(IF, IF_ref)[0] * 100
+    MAE = np.sum(np.absolute(IF - IF_ref)) / len(IF)
+    return corr, MAE
+
+
+# Shift (s) of the reference that best matches the estimated ENF within +-MaxLag, and its similarity (%)
+def best_lag(IF, IF_ref_padded, MaxLag):
+    Scores = AllLagScores(IF_ref_padded, IF, 'PCC')
+    Lag = int(np.argmin(Scores))
+    if not np.isfinite(Scores[Lag]):
+        return None, None
+    return Lag - MaxLag, -Scores[Lag] * 100
+
+
+# Every figure of one dvSave-* recording folder or dvSave-*.aedat4 file, errors are reported in the result instead of raised.
+# result['timings'] holds the wall seconds of every stage and result['metrics'] the whole RunMetrics record;
+# with profile_path the run is profiled with cProfile and the stats dumped there, TraceMemory adds the
+# tracemalloc peak of every stage. Cache and Estimator are passed to estimate_ENF.
+def process_recording(record_path, reference_folder, MaxLag=30, Archive=None, Tiles=None, TopTiles=4, Chunked=False,
+                      profile_path=None, TraceMemory=False, Cache=None, Estimator='stft'):
+    record_path = record_path.rstrip('/')
+    FILENAME = os.path.basename(record_path).split('.')[0]
+    metrics = RunMetrics(FILENAME, TraceMemory)
+    result = dict(name=FILENAME, path=record_path)
+    try:
+        with profiled(profile_path):
+            Record_begin = parse_recording_name(FILENAME)
+            result['begin'] = Record_begin.isoformat()
+            IF = estimate_ENF(record_path if record_path.endswith('.aedat4') else record_path + '/events', metrics,
+                              Tiles=Tiles, TopTiles=TopTiles, Chunked=Chunked, Cache=Cache, Estimator=Estimator)
+            result['seconds'] = len(IF)
+
+            with metrics.stage('reference') as stage:
+                if Archive is None:
+                    Archive = ReferenceArchive(reference_folder, 16, 1, 200)
+                IF_ref_padded = reference_ENF(Archive, Record_begin, len(IF), MaxLag).astype(np.float64)
+                stage['samples'] = len(IF_ref_padded)
+
+            with metrics.stage('compare') as stage:
+                result['corr'], result['MAE'] = compare_ENF(IF, IF_ref_padded[MaxLag:MaxLag + len(IF)])
+                result['lag'], result['lag_corr'] = best_lag(IF, IF_ref_padded, MaxLag)
+                stage['samples'] = len(IF)
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    result['metrics'] = metrics.finish()
+    result['timings'] = metrics.timings()
+    return result
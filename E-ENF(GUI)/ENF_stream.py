@@ -0,0 +1,230 @@
+import time
+import socket
+import struct
+import argparse
+from collections import deque
+import numpy as np
+from scipy import signal
+from AccurateSTFT import FramesIF, SlidingDFT
+from TDMF import StreamingTDMF
+from DV_data import PolaritySampler, EventStream, aedat_packets
+
+# ######## Real-time ENF estimation
+# Event packets are pushed as they arrive and ENF samples come out every AStepSize samples:
+#   PolaritySampler -> 98-102 Hz bandpass (sosfilt, filter state kept between packets) -> ring buffer of
+#   the last AWindowLength samples -> FramesIF on the newest frame -> StreamingTDMF
+# Frame k holds the same samples as frame k of AccurateSTFT (centred on sample k * AStepSize, the Half
+# samples before the first one being zeros), so with the same causal filter the stream gives exactly
+# the offline result. The filter is causal, unlike the offline filtfilt, so the IF series is the same
+# but the 100 Hz phase is delayed; the memory is bounded by the window and the TDMF order.
+#
+# Latency of an ENF sample is the wall time from the arrival of the packet holding its centre sample
+# to its output. It is dominated by the data the estimate has to wait for:
+#   AWindowLength / 2 samples for the frame to be complete (8 s with the GUI settings)
+#   (Order - 1) / 2 frames for the TDMF window to be complete (10 s with Order 21)
+# so about 18 s, plus the processing time of the packets in between (a few ms per sample). Every
+# sample's measured latency is kept in the latency deque.
+# With Estimator='sliding' the frames come from a SlidingDFT fed with the same padded samples, which
+# transforms one step of new samples per frame instead of the whole window; the ring buffer is not used.
+
+
+class StreamingENF:
+    def __init__(self, ConstFs=1000, AWindowLength=16000, AStepSize=1000, NFFT=200000, Order=21, Threshold=0.02,
+                 Estimator='stft'):
+        self.ConstFs = ConstFs
+        self.AWindowLength = AWindowLength
+        self.AStepSize = AStepSize
+        self.NFFT = NFFT
+        self.Half = int(AWindowLength / 2)
+        self.sampler = PolaritySampler(ConstFs)
+        self.sos = signal.butter(4, [(98 * 2 / ConstFs), (102 * 2 / ConstFs)], 'bandpass', output='sos')
+        self.zi = np.zeros((self.sos.shape[0], 2))
+        self.tdmf = StreamingTDMF(Order, Threshold)
+        self.sliding = None
+        if Estimator == 'sliding':
+            self.sliding = SlidingDFT(AWindowLength, AStepSize, ConstFs, NFFT)
+            self.sliding.push(np.zeros(self.Half - 1))  # frame 0 starts Half - 1 samples before the signal
+
+        self.ring = np.zeros(AWindowLength)
+        self.head = 0
+        self.count = 0  # samples received
+        self.frames = 0  # frames transformed
+        self.arrivals = deque()  # (samples received after a packet, arrival time of the packet)
+        self.pending = deque()  # (centre time, centre arrival time) of the frames inside the TDMF window
+        self.latency = deque(maxlen=100000)
+
+    def write(self, data):
+        size = len(self.ring)
+        if len(data) >= size:
+            self.ring[:] = data[-size:]
+            self.head = 0
+            return
+        first = min(len(data), size - self.head)
+        self.ring[self.head:self.head + first] = data[:first]
+        self.ring[:len(data) - first] = data[first:]
+        self.head = (self.head + len(data)) % size
+
+    def frame(self):
+        return np.concatenate((self.ring[self.head:], self.ring[:self.head]))
+
+    # ENF samples completed by one packet, as a list of (centre time in micro-seconds, ENF)
+    def push(self, t, p, arrival=None):
+        if arrival is None:
+            arrival = time.perf_counter()
+        return self.process(self.sampler.push(t, p), arrival)
+
+    # padding samples are appended after the filter, as AccurateSTFT pads the filtered signal
+    def process(self, data, arrival, frame_end=None, padding=False):
+        if len(data) == 0:
+            return []
+        if padding:
+            filtered = data
+        else:
+            filtered, self.zi = signal.sosfilt(self.sos, data, zi=self.zi)
+        begin = self.count
+        self.count = self.count + len(data)
+        self.arrivals.append((self.count, arrival))
+
+        # frame k is complete once sample k * AStepSize + Half is received
+        frames = []
+        completed = 0
+        position = begin
+        while frame_end is None or self.frames < frame_end:
+            complete = self.frames * self.AStepSize + self.Half + 1
+            if complete > self.count:
+                break
+            if self.sliding is None:  # the sliding DFT keeps its own blocks, the ring is not needed
+                self.write(filtered[position - begin:complete - begin])
+                frames.append(self.frame())
+            position = complete
+            completed = completed + 1
+            centre = self.frames * self.AStepSize
+            while self.arrivals[0][0] <= centre:
+                self.arrivals.popleft()
+            centre_time = self.sampler.begin_time + (centre + 1) * self.sampler.delta_t
+            self.pending.append((int(centre_time), self.arrivals[0][1]))
+            self.frames = self.frames + 1
+        if self.sliding is None:
+            self.write(filtered[position - begin:])
+        else:
+            IF = self.sliding.push(filtered)  # completes the same frames
+        if completed == 0:
+            return []
+        if self.sliding is None:
+            IF = FramesIF(np.array(frames), self.ConstFs, self.NFFT)
+        return self.output([Value for Sample in IF for Value in self.tdmf.push(Sample)])
+
+    def output(self, values):
+        now = time.perf_counter()
+        samples = []
+        for value in values:
+            centre_time, centre_arrival = self.pending.popleft()
+            self.latency.append(now - centre_arrival)
+            samples.append((centre_time, value / 2))
+        return samples
+
+    # end of the stream: the last frames are zero padded as in AccurateSTFT
+    def flush(self):
+        arrival = time.perf_counter()
+        samples = self.process(self.sampler.finish(), arrival)
+        frame_end = self.count // self.AStepSize + 1
+        samples = samples + self.process(np.zeros(self.Half + 1), arrival, frame_end, True)
+        return samples + self.output(self.tdmf.flush())
+
+
+# ######## Event sources, each yields (t, p) packets with t in micro-seconds (aedat_packets for aedat4 files)
+def events_packets(events_path):
+    for t, x, y, p in EventStream(events_path).chunks():
+        yield t, p
+
+
+# Releases each packet when the wall clock reaches its last event time, as a live camera would
+def realtime_packets(packets, speed=1.0):
+    start = None
+    for t, p in packets:
+        if len(t) == 0:
+            continue
+        if start is None:
+            start = (time.perf_counter(), int(t[0]))
+        wait = (int(t[-1]) - start[1]) / 1e6 / speed - (time.perf_counter() - start[0])
+        if wait > 0:
+            time.sleep(wait)
+        yield t, p
+
+
+# Local socket stand-in for a camera: every packet is sent as its event count (uint32) followed by
+# the timestamps (int64) and the polarities (uint8)
+PacketHeader = struct.Struct('<I')
+
+
+def serve_packets(packets, port, host='127.0.0.1'):
+    with socket.create_server((host, port)) as server:
+        connection, address = server.accept()
+        with connection:
+            for t, p in packets:
+                connection.sendall(PacketHeader.pack(len(t)) + np.ascontiguousarray(t, dtype=np.int64).tobytes()
+                                   + np.ascontiguousarray(p, dtype=np.uint8).tobytes())
+
+
+def receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        block = connection.recv(size - len(data))
+        if not block:
+            return None
+        data.extend(block)
+    return bytes(data)
+
+
+def socket_packets(port, host='127.0.0.1'):
+    with socket.create_connection((host, port)) as connection:
+        while True:
+            header = receive_exactly(connection, PacketHeader.size)
+            if header is None:
+                return
+            size = PacketHeader.unpack(header)[0]
+            data = receive_exactly(connection, size * 9)
+            if data is None:
+                return
+            yield np.frombuffer(data[:size * 8], dtype=np.int64), np.frombuffer(data[size * 8:], dtype=np.uint8)
+
+
+def run_stream(packets, output=print, Estimator='stft'):
+    stream = StreamingENF(Estimator=Estimator)
+    for t, p in packets:
+        for centre_time, value in stream.push(t, p):
+            output('%.3f  %.5f Hz  latency %.3f s' % (centre_time / 1e6, value, stream.latency[-1]))
+    for centre_time, value in stream.flush():
+        output('%.3f  %.5f Hz' % (centre_time / 1e6, value))
+    if len(stream.latency) > 0:
+        latency = np.array(stream.latency)
+        output('latency  mean %.3f s  median %.3f s  95%% %.3f s  max %.3f s' % (
+            latency.mean(), np.median(latency), np.percentile(latency, 95), latency.max()))
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate the ENF of an event stream as it arrives.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--aedat', help='replay an aedat4 recording')
+    source.add_argument('--events', help="replay an unpacked 'events' folder")
+    source.add_argument('--socket', type=int, help='receive packets from a local socket on this port')
+    parser.add_argument('--serve', type=int, help='send the replayed packets to a local socket on this port instead')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 replays as fast as possible')
+    parser.add_argument('--estimator', choices=('stft', 'sliding'), default='stft', help='STFT backend')
+    args = parser.parse_args()
+
+    if args.socket is not None:
+        packets = socket_packets(args.socket)
+    else:
+        packets = aedat_packets(args.aedat) if args.aedat else events_packets(args.events)
+        if args.speed > 0:
+            packets = realtime_packets(packets, args.speed)
+    if args.serve is not None:
+        serve_packets(packets, args.serve)
+    else:
+        run_stream(packets, Estimator=args.estimator)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,27 @@
 import numpy as np
-import copy
+from sliding_match import SlidingDistance, TopLags
 
 # #######IFtest is the estimated ENF
 # #######ENFdata is the reference ENF
-def MMSE(ConstFs, AStepSize, ENFData, IFtest, AWindowLength):
+# #######TopK > 0 also returns the indices and scores of the TopK best lags
+def MMSE(ConstFs, AStepSize, ENFData, IFtest, AWindowLength, TopK=0):
     ENFData       = np.array(ENFData)
     RecordLength  = len(IFtest)
     ENFLength     = len(ENFData)
     OverFact = AStepSize / ConstFs
-    MSECalibrated = np.ones(ENFLength-RecordLength)
     if ENFLength >= RecordLength:
-        for i in range(ENFLength-RecordLength):
-            IF0          = ENFData[i: i+RecordLength]
-            TempIF1      = copy.copy(IFtest)
-            TempIF1      = np.array(TempIF1)
-            bbb              = IF0-TempIF1
-            MSECalibrated[i] = np.linalg.norm(bbb)/RecordLength
+        # all lags at once
+        MSECalibrated = SlidingDistance(ENFData, IFtest)[:ENFLength-RecordLength] / RecordLength
         m  = MSECalibrated
-        # ### Find the minimum index
-        min_score = m[0]
-        min_index1    = 0
-        for ii in range(ENFLength-RecordLength):
-            if m[ii] < min_score:
-                min_score     = m[ii]
-                min_index1    = ii
+        if np.isnan(m).all():
+            raise ValueError('every lag of the reference touches a gap')
+        # ### Find the minimum index, lags touching a gap of the reference are skipped
+        min_index1    = int(np.argmin(np.where(np.isnan(m), np.inf, m)))
 
         FinalIndex = min_index1
 
         StartTimeIndex = int(OverFact * FinalIndex)
-        MinScore = min(MSECalibrated)
+        MinScore = m[FinalIndex]
         EndTimeIndex = int(StartTimeIndex + OverFact * RecordLength - OverFact)
         StartSec = int(StartTimeIndex % 60)
         StartMin = (StartTimeIndex - StartSec) / 60
@@ -36,4 +29,7 @@ def MMSE(ConstFs, AStepSize, ENFData, IFtest, AWindowLength):
         EndMin = (EndTimeIndex - EndSec) / 60
         CalibratedIF = ENFData[FinalIndex: FinalIndex+RecordLength]
 
+    if TopK > 0:
+        TopIndex, TopScore = TopLags(MSECalibrated, TopK, Largest=False)
+        return CalibratedIF, StartMin, StartSec, EndMin, EndSec, StartTimeIndex, EndTimeIndex, MinScore, TopIndex, TopScore
     return CalibratedIF, StartMin, StartSec, EndMin, EndSec, StartTimeIndex, EndTimeIndex, MinScore
\ No newline at end of file
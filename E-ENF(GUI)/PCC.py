@@ -1,36 +1,28 @@
 ##Pearson correlation coefficient
 import numpy as np
-import copy
-from scipy.stats import pearsonr
-from TDMF import TDMF
+from sliding_match import SlidingPearson, TopLags
 # #######IFtest is the estimated ENF
 # #######ENFdata is the reference ENF
-def PCC(ConstFs, AStepSize, ENFData, IFtest, AWindowLength):
+# #######TopK > 0 also returns the indices and scores of the TopK best lags
+def PCC(ConstFs, AStepSize, ENFData, IFtest, AWindowLength, TopK=0):
     ENFData       = np.array(ENFData)
     RecordLength  = len(IFtest)
     ENFLength     = len(ENFData)
     OverFact = AStepSize / ConstFs
-    Calibrated = np.ones(ENFLength-RecordLength)
     if ENFLength >= RecordLength:
-        for i in range(ENFLength-RecordLength):
-            IF0          = ENFData[i: i+RecordLength]
-            TempIF1      = copy.copy(IFtest)
-            TempIF1      = np.array(TempIF1)
-            Calibrated[i]=pearsonr(IF0,TempIF1)[0]
+        # all lags at once
+        Calibrated = SlidingPearson(ENFData, IFtest)[:ENFLength-RecordLength]
 
         m  = Calibrated
-        # ### Find the minimum index
-        min_score = m[0]
-        min_index1    = 0
-        for ii in range(ENFLength-RecordLength):
-            if m[ii] > min_score:
-                min_score     = m[ii]
-                min_index1    = ii
+        if np.isnan(m).all():
+            raise ValueError('every lag of the reference touches a gap or is flat')
+        # ### Find the maximum index, lags with an undefined correlation are skipped
+        min_index1    = int(np.argmax(np.where(np.isnan(m), -np.inf, m)))
 
         FinalIndex = min_index1
 
         StartTimeIndex = int(OverFact * FinalIndex)
-        MaxScore = max(Calibrated)
+        MaxScore = m[FinalIndex]
         EndTimeIndex = int(StartTimeIndex + OverFact * RecordLength - OverFact)
         StartSec = int(StartTimeIndex % 60)
         StartMin = (StartTimeIndex - StartSec) / 60
@@ -38,4 +30,7 @@ def PCC(ConstFs, AStepSize, ENFData, IFtest, AWindowLength):
         EndMin = (EndTimeIndex - EndSec) / 60
         CalibratedIF = ENFData[FinalIndex: FinalIndex+RecordLength]
 
+    if TopK > 0:
+        TopIndex, TopScore = TopLags(Calibrated, TopK, Largest=True)
+        return CalibratedIF, StartMin, StartSec, EndMin, EndSec, StartTimeIndex, EndTimeIndex, MaxScore, TopIndex, TopScore
     return CalibratedIF, StartMin, StartSec, EndMin, EndSec, StartTimeIndex, EndTimeIndex, MaxScore
\ No newline at end of file
@@ -1,27 +1,73 @@
 # ################Smooth function
 import math
+import bisect
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
 def TDMF(Input, Order, Threshold):
+    Input = np.asarray(Input, dtype=np.float64)
     InputLength = len(Input)
-    FilteredInput = [None] * InputLength
-    Output = [None] * InputLength
     PaddingLength = int((int(Order) - 1) / 2)
-    Oneline = [1] * PaddingLength
-    PadInput = [Oneline[i] * Input[0] for i in range(PaddingLength)]
-    PadInput[PaddingLength:PaddingLength + InputLength] = Input
-    PadInput[PaddingLength + InputLength:PaddingLength * 2 + InputLength] = [Oneline[i] * Input[-1] for i in
-                                                                             range(PaddingLength)]
-
-    for i in range(InputLength):
-        Seg = PadInput[i: i + Order]
-        Seg.sort()
-        FilteredInput[i] = Seg[math.ceil((Order - 1) / 2)]
-
-    DetrendedInput = [FilteredInput[ii] - Input[ii] for ii in range(InputLength)]
-    for i in range(InputLength):
-        if abs(DetrendedInput[i]) <= Threshold:
-            Output[i] = Input[i]
-        else:
-            Output[i] = FilteredInput[i]
+    # Pad with the first and last samples; with an even Order the last window is one sample short,
+    # so it is completed with +inf, which never moves the picked element
+    PadInput = np.concatenate((np.full(PaddingLength, Input[0]), Input, np.full(PaddingLength, Input[-1]),
+                               np.full(Order - 1 - 2 * PaddingLength, np.inf)))
+
+    # Median of every window at once: a partial sort of the strided windows
+    Seg = sliding_window_view(PadInput, Order)[:InputLength]
+    FilteredInput = np.partition(Seg, math.ceil((Order - 1) / 2), axis=1)[:, math.ceil((Order - 1) / 2)]
+
+    DetrendedInput = FilteredInput - Input
+    Output = np.where(np.abs(DetrendedInput) <= Threshold, Input, FilteredInput)
     return Output
 
 
+# ################Streaming smooth function
+# Samples are pushed one at a time and each output equals TDMF over the whole series. Output i needs
+# input i + PaddingLength, so push() returns the newly completed outputs (zero or one), and flush()
+# pads with the last sample to complete the series. The window is kept sorted, so a sample costs a
+# binary search and one insertion and one removal instead of a sort.
+class StreamingTDMF:
+    def __init__(self, Order, Threshold):
+        self.Order = Order
+        self.Threshold = Threshold
+        self.PaddingLength = int((int(Order) - 1) / 2)
+        self.MedianIndex = math.ceil((Order - 1) / 2)
+        self.Window = deque()
+        self.SortedWindow = []
+        self.Pending = deque()
+
+    def _step(self, Sample):
+        self.Window.append(Sample)
+        bisect.insort(self.SortedWindow, Sample)
+        if len(self.Window) < self.Order:
+            return []
+        Median = self.SortedWindow[self.MedianIndex]
+        Center = self.Pending.popleft()
+        del self.SortedWindow[bisect.bisect_left(self.SortedWindow, self.Window.popleft())]
+        if abs(Median - Center) <= self.Threshold:
+            return [Center]
+        return [Median]
+
+    def push(self, Sample):
+        Sample = float(Sample)
+        if not self.Window and not self.Pending:
+            for i in range(self.PaddingLength):
+                self._step(Sample)
+        self.Pending.append(Sample)
+        return self._step(Sample)
+
+    def flush(self):
+        Output = []
+        if not self.Pending:
+            return Output
+        Last = self.Pending[-1]
+        for i in range(self.PaddingLength):
+            Output += self._step(Last)
+        for i in range(self.Order - 1 - 2 * self.PaddingLength):
+            Output += self._step(np.inf)
+        self.Window.clear()
+        self.SortedWindow = []
+        return Output
@@ -0,0 +1,103 @@
+import os
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from reference_archive import ReferenceArchive
+from ENF_pipeline import process_recording, Estimators
+from metrics import append_record
+from track_cache import TrackCache, CacheFolder
+
+# ######## Headless E-ENF over every recording of an Unpacked or Raw folder
+#   python batch_ENF.py Events/Unpacked Events/ENF_Reference --workers 4 --output ENF_results
+# Each recording is processed in its own worker process. One
+# <recording>.json is written per recording as soon as it finishes and results.csv sums them up.
+# Every recording's stage metrics (wall and CPU time, peak memory, events/s, samples/s) are in its json;
+# --metrics FILE also appends them to a JSON lines file, --trace-memory adds the tracemalloc peak of every
+# stage and --profile dumps <recording>.prof cProfile stats. --cache keeps the sampled signal and the ENF
+# track of every recording in <recordings>/.enf_cache, so that a second run only reads them back.
+# --estimator sliding uses the sliding DFT instead of transforming every STFT window.
+CsvFields = ['name', 'begin', 'seconds', 'corr', 'MAE', 'lag', 'lag_corr',
+             'sampling', 'bandpass', 'stft', 'tdmf', 'reference', 'compare', 'total', 'error']
+
+
+# dvSave-* folders with an 'events' folder (Events/Unpacked) and dvSave-*.aedat4 files (Events/Raw), the
+# aedat4 files being sampled directly without unpacking
+def find_recordings(folder):
+    recordings = []
+    for name in sorted(os.listdir(folder)):
+        if not name.startswith('dvSave-'):
+            continue
+        if os.path.isdir(folder + '/' + name + '/events') or name.endswith('.aedat4'):
+            recordings.append(folder + '/' + name)
+    return recordings
+
+
+# tiles=(rows, cols) samples every recording per tile and combines the top_tiles best ones
+def run_batch(recordings_folder, reference_folder, output_folder='ENF_results', workers=None, max_lag=30, progress=print,
+              tiles=None, top_tiles=4, chunked=False, metrics_path=None, profile=False, trace_memory=False,
+              cache_size=None, estimator='stft'):
+    recordings = find_recordings(recordings_folder.rstrip('/'))
+    cache = None if cache_size is None else TrackCache(recordings_folder.rstrip('/') + '/' + CacheFolder, cache_size)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    # the shared reference timeline is created once here, the workers read the reference spans they need
+    ReferenceArchive(reference_folder, 16, 1, 200)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_recording, i, reference_folder, max_lag, None, tiles, top_tiles, chunked,
+                               output_folder + '/' + os.path.basename(i).split('.')[0] + '.prof' if profile else None, trace_memory, cache,
+                               estimator)
+                   for i in recordings]
+        for n, future in enumerate(as_completed(futures)):
+            result = future.result()
+            results.append(result)
+            with open(output_folder + '/' + result['name'] + '.json', 'w') as f:
+                json.dump(result, f, indent=2)
+            if metrics_path is not None:
+                append_record(metrics_path, result['metrics'])
+            if progress is not None:
+                if 'error' in result:
+                    progress('[%d/%d] %s failed, %s' % (n + 1, len(recordings), result['name'], result['error']))
+                else:
+                    progress('[%d/%d] %s  corr %.2f%%  MAE %f  lag %s s  %.1f s' % (
+                        n + 1, len(recordings), result['name'], result['corr'], result['MAE'], result['lag'], result['timings']['total']))
+
+    results.sort(key=lambda x: x['name'])
+    with open(output_folder + '/results.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CsvFields, extrasaction='ignore')
+        writer.writeheader()
+        for result in results:
+            row = dict(result)
+            row.update(result['timings'])
+            writer.writerow(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate and score the ENF of every recording in an Unpacked folder.')
+    parser.add_argument('recordings', help='Events/Unpacked folder of dvSave-* recordings or Events/Raw folder of aedat4 files')
+    parser.add_argument('reference', help='ENF_Reference folder')
+    parser.add_argument('--output', default='ENF_results', help='folder for the json and csv results')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, all cores by default')
+    parser.add_argument('--max-lag', type=int, default=30, help='largest reference shift searched, in seconds')
+    parser.add_argument('--tiles', default=None, help="sample per tile of a ROWSxCOLS grid, e.g. '4x4'")
+    parser.add_argument('--top-tiles', type=int, default=4, help='tiles combined by SNR, 1 keeps the best tile alone')
+    parser.add_argument('--chunked', action='store_true', help='sample, filter and transform block by block, in memory independent of the duration')
+    parser.add_argument('--metrics', default=None, help='append the stage metrics of every recording to this JSON lines file')
+    parser.add_argument('--profile', action='store_true', help='dump cProfile stats of every recording to the output folder')
+    parser.add_argument('--trace-memory', action='store_true', help='record the peak memory of every stage with tracemalloc (slower)')
+    parser.add_argument('--cache', action='store_true', help='reuse the sampled signals and ENF tracks of earlier runs')
+    parser.add_argument('--cache-size', type=int, default=512, help='size limit of the cache in MB')
+    parser.add_argument('--estimator', choices=Estimators, default='stft',
+                        help='STFT backend, sliding updates only the bins around 100 Hz step by step')
+    args = parser.parse_args()
+    tiles = None if args.tiles is None else tuple(int(i) for i in args.tiles.lower().split('x'))
+    run_batch(args.recordings, args.reference, args.output, args.workers, args.max_lag, print, tiles, args.top_tiles,
+              args.chunked, args.metrics, args.profile, args.trace_memory,
+              args.cache_size * 2 ** 20 if args.cache else None, args.estimator)
+
+
+if __name__ == '__main__':
+    main()
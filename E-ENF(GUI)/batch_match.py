@@ -0,0 +1,114 @@
+import numpy as np
+from scipy import fft
+from sliding_match import TopLags, FillGaps, ValidLags, FlatVariance
+
+# ######## Many queries against one reference
+# MMSE() and PCC() prepare the reference again for every query. ReferenceMatcher prepares it once:
+# its mean, the running sums of its windows and, for every block size, the spectra of its overlapping
+# blocks. Each query is then cross-correlated by overlap-save: one FFT of the query at the block size
+# of its length (the smallest power of two at least twice as long), a product with the cached block
+# spectra and one batched inverse FFT, for all the queries of a length class at once and across
+# Workers cores (scipy.fft workers, -1 for all). The FFT work per query grows with the reference length
+# times log(block size) instead of log(reference length); every lag still gets a score, as in MMSE()
+# and PCC(), whose lags 0 .. len(ENFData) - len(IFtest) - 1 and scores these are. As there, lags whose
+# window touches a NaN gap of the reference and, for PCC, flat windows score NaN.
+MinBlock = 64
+MaxBatchPoints = 2 ** 22  # spectrum bins multiplied and inverse transformed together
+
+
+class ReferenceMatcher:
+    def __init__(self, ENFData, Workers=None):
+        ENFData = np.asarray(ENFData, dtype=np.float64)
+        self.Length = len(ENFData)
+        self.Workers = Workers
+        self.Reference = ENFData
+        self.Gaps = np.isnan(ENFData).any()
+        # shifted by the mean as in SlidingDistance, which keeps the running sums well conditioned
+        Filled = FillGaps(ENFData)
+        self.Offset = np.mean(Filled)
+        self.Data = Filled - self.Offset
+        self.CumSum = np.concatenate(([0.0], np.cumsum(self.Data)))
+        self.CumSquare = np.concatenate(([0.0], np.cumsum(self.Data * self.Data)))
+        self.Blocks = dict()
+
+    @staticmethod
+    def BlockSize(RecordLength):
+        return max(MinBlock, 1 << int(np.ceil(np.log2(max(2 * (RecordLength - 1), 1)))))
+
+    # spectra of the blocks Data[k * Block / 2:k * Block / 2 + Block], zero padded after the end
+    def BlockSpectra(self, Block):
+        if Block not in self.Blocks:
+            Step = Block // 2
+            Count = -(-self.Length // Step)
+            Padded = np.zeros(Count * Step + Block)
+            Padded[:self.Length] = self.Data
+            Segments = np.lib.stride_tricks.sliding_window_view(Padded, Block)[::Step][:Count]
+            self.Blocks[Block] = fft.rfft(Segments, axis=1, workers=self.Workers)
+        return self.Blocks[Block]
+
+    # sum(Data[i:i + len(Query)] * Query) for every lag i of every query, all of one block size
+    def CrossCorrelations(self, Queries, Block):
+        Spectra = self.BlockSpectra(Block)
+        Step = Block // 2
+        Results = [None] * len(Queries)
+        Group = max(1, MaxBatchPoints // Spectra.size)
+        for i in range(0, len(Queries), Group):
+            Batch = Queries[i:i + Group]
+            QuerySpectra = fft.rfft(np.array([np.pad(q[::-1], (0, Block - len(q))) for q in Batch]), axis=1, workers=self.Workers)
+            Blocks = fft.irfft(Spectra[None, :, :] * QuerySpectra[:, None, :], Block, axis=2, workers=self.Workers)
+            for k, Query in enumerate(Batch):
+                LagCount = self.Length - len(Query) + 1
+                # the first Step lags of every block are free of wrap-around since len(Query) <= Step + 1
+                Valid = Blocks[k, :, len(Query) - 1:len(Query) - 1 + Step].ravel()
+                Results[i + k] = Valid[:LagCount]
+        return Results
+
+    # scores of every lag for each query: MMSE distance (lower is better) or PCC coefficient (higher is better)
+    def scores(self, Queries, Metric='MMSE'):
+        Queries = [np.asarray(q, dtype=np.float64) for q in Queries]
+        for Query in Queries:
+            if not 1 <= len(Query) < self.Length:
+                raise ValueError('every query must be shorter than the reference')
+        if Metric == 'MMSE':
+            Shifted = [q - self.Offset for q in Queries]
+        else:
+            Shifted = [q - np.mean(q) for q in Queries]
+        Classes = dict()
+        for n, Query in enumerate(Shifted):
+            Classes.setdefault(self.BlockSize(len(Query)), []).append(n)
+        Correlations = [None] * len(Queries)
+        for Block, Members in Classes.items():
+            for n, Correlation in zip(Members, self.CrossCorrelations([Shifted[n] for n in Members], Block)):
+                Correlations[n] = Correlation
+
+        Scores = []
+        for Query, Correlation in zip(Shifted, Correlations):
+            RecordLength = len(Query)
+            Sum = self.CumSum[RecordLength:] - self.CumSum[:-RecordLength]
+            Energy = self.CumSquare[RecordLength:] - self.CumSquare[:-RecordLength]
+            if Metric == 'MMSE':
+                Score = np.sqrt(np.maximum(Energy - 2 * Correlation + np.dot(Query, Query), 0)) / RecordLength
+            else:
+                WindowVariance = Energy - Sum * Sum / RecordLength
+                Variance = np.maximum(WindowVariance, 0) * np.dot(Query, Query)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    Score = np.clip(Correlation / np.sqrt(Variance), -1, 1)
+                Score[WindowVariance <= FlatVariance * Energy] = np.nan
+            if self.Gaps:
+                Score[~ValidLags(self.Reference, RecordLength)] = np.nan
+            Scores.append(Score[:self.Length - RecordLength])
+        return Scores
+
+    # (best lag, its score, TopK best lags, their scores) for each query, lags in reference samples
+    def match(self, Queries, Metric='MMSE', TopK=5):
+        Results = []
+        for Score in self.scores(Queries, Metric):
+            if np.isnan(Score).all():
+                raise ValueError('every lag of the reference touches a gap' + (' or is flat' if Metric != 'MMSE' else ''))
+            TopIndex, TopScore = TopLags(Score, TopK, Largest=Metric != 'MMSE')
+            Results.append((int(TopIndex[0]), TopScore[0], TopIndex, TopScore))
+        return Results
+
+
+def BatchMatch(ENFData, Queries, Metric='MMSE', TopK=5, Workers=None):
+    return ReferenceMatcher(ENFData, Workers).match(Queries, Metric, TopK)
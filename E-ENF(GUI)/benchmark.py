@@ -0,0 +1,198 @@
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+from scipy import signal
+from DV_data import event_files_sampling, Event_txt_loader, EventStream
+from AccurateSTFT import AccurateSTFT, AccurateSTFTBlocks, SlidingSTFT, SlidingSTFTBlocks
+from ENF_stream import StreamingENF, events_packets
+from TDMF import TDMF
+from MMSE import MMSE
+from PCC import PCC
+from batch_match import BatchMatch
+from read_txt import event_timesurface
+from reference_archive import ReferenceArchive
+from synthetic_events import write_synthetic_recording, synthetic_enf, epoch_seconds
+from synthetic_reference import write_synthetic_reference
+from metrics import RunMetrics, format_record
+from ENF_pipeline import estimate_ENF
+
+# ######## Benchmark on synthetic data
+#   python benchmark.py --sizes 300 600 1200 --json benchmark.json
+# For every size (seconds of recording) a synthetic recording, in both the txt and the binary layout,
+# and a synthetic ENF_Reference are generated, every stage of the pipeline is timed on them and the
+# results are checked against the ground-truth ENF:
+#   the estimated ENF and the reference ENF must stay within MaxError of synthetic_enf
+#   MMSE and PCC must find the recording at its true offset in the reference
+#   BatchMatch must give pieces of the recording the same lags as MMSE does one by one
+#   SlidingSTFT must give the frequencies of AccurateSTFT within SlidingTolerance, every frame, zero
+#   padded edges included, and so must SlidingSTFTBlocks and StreamingENF(Estimator='sliding') against
+#   AccurateSTFTBlocks and StreamingENF
+#   on a recording whose first sample is 0, estimate_ENF must give the ENF of estimate_ENF(Chunked=True)
+#   on every frame, edges included (filtfilt extends the signal edges in the dtype of its input)
+# The process exits with status 1 when a check fails.
+ConstFs = 1000
+AWindowLength = 16 * ConstFs
+AStepSize = ConstFs
+NFFT = 200 * ConstFs
+MaxError = 0.003  # Hz, mean absolute error allowed against the ground truth
+BinBias = 1 / 200  # Hz, AccurateSTFT reports its peaks one NFFT bin low (1-based index of the MATLAB original)
+Offset = 600  # seconds of reference before the recording
+Edge = 10  # frames left out of the checks at both ends (half window, TDMF)
+Queries = 100  # pieces of the recording matched together by BatchMatch
+BlockSize = 4096  # samples per block given to the STFT blocks functions
+EdgeSeconds = 60  # length of the recording of the edge check
+EdgeSeed = 3  # its seed, whose first sample is 0
+ChunkedTolerance = 1e-4  # Hz, filtfilt and ChunkedFiltFilt differ by about 1e-8 in the signal
+SlidingTolerance = 1e-9  # Hz, rounding allowed between SlidingSTFT and AccurateSTFT
+
+
+def timed(metrics, name, function, *args, count=None, unit=None):
+    with metrics.stage(name) as stage:
+        output = function(*args)
+        if count is not None:
+            stage[unit] = count
+    return output
+
+
+def check(checks, name, value, passed):
+    checks.append(dict(check=name, value=float(value), passed=bool(passed)))
+
+
+# largest difference between two frequency series, inf when their lengths or NaN frames differ
+def difference(IF, Expected):
+    IF, Expected = np.asarray(IF), np.asarray(Expected)
+    if IF.shape != Expected.shape or not np.array_equal(np.isnan(IF), np.isnan(Expected)):
+        return np.inf
+    return np.nanmax(np.abs(IF - Expected), initial=0)
+
+
+def stft_blocks(STFTBlocks, Signal):
+    return np.concatenate(list(STFTBlocks((Signal[i:i + BlockSize] for i in range(0, len(Signal), BlockSize)),
+                                          AWindowLength, AStepSize, ConstFs, NFFT)))
+
+
+def stream_enf(events_path, Estimator):
+    stream = StreamingENF(ConstFs, AWindowLength, AStepSize, NFFT, Estimator=Estimator)
+    samples = []
+    for t, p in events_packets(events_path):
+        samples.extend(stream.push(t, p))
+    samples.extend(stream.flush())
+    return np.array([value for centre_time, value in samples])
+
+
+def run_size(seconds, workdir, seed=0, trace_memory=False):
+    begin = datetime(2022, 8, 17, 20, 10, 23)
+    record_dir = workdir + '/%d' % seconds
+    shutil.rmtree(record_dir, ignore_errors=True)
+    bin_path = write_synthetic_recording(record_dir + '/bin', begin, seconds, seed=seed)
+    txt_path = write_synthetic_recording(record_dir + '/txt', begin, seconds, seed=seed, event_format='txt')
+    first_hour_end = (begin - timedelta(seconds=Offset)).replace(minute=0, second=0) + timedelta(hours=1)
+    hours = int(np.ceil((begin + timedelta(seconds=seconds + Offset) - first_hour_end).total_seconds() / 3600)) + 1
+    write_synthetic_reference(record_dir + '/ENF_Reference', first_hour_end, hours, seed=seed)
+    stream = EventStream(bin_path)
+    events = int(stream.chunk_size.sum())
+
+    results = RunMetrics('%d s' % seconds, trace_memory)
+    checks = []
+    loader = timed(results, 'Event_txt_loader (one events file)', Event_txt_loader, txt_path + '/events0.txt')
+    results.stages['Event_txt_loader (one events file)']['events'] = loader.size
+    timed(results, 'event_files_sampling (txt)', event_files_sampling, txt_path, ConstFs, count=events, unit='events')
+    Use_data = timed(results, 'event_files_sampling (bin)', event_files_sampling, bin_path, ConstFs, count=events, unit='events')
+
+    b, a = signal.butter(4, [(98 * 2 / ConstFs), (102 * 2 / ConstFs)], 'bandpass')
+    data_after_fir = timed(results, 'filtfilt', signal.filtfilt, b, a, Use_data, count=len(Use_data), unit='samples')
+    IFtest1 = timed(results, 'AccurateSTFT', AccurateSTFT, data_after_fir, AWindowLength, AStepSize, ConstFs, NFFT,
+                    count=len(data_after_fir), unit='samples')
+    IFsliding = timed(results, 'SlidingSTFT', SlidingSTFT, data_after_fir, AWindowLength, AStepSize, ConstFs, NFFT,
+                      count=len(data_after_fir), unit='samples')
+    error = difference(IFsliding, IFtest1)
+    check(checks, 'SlidingSTFT - AccurateSTFT (Hz)', error, error < SlidingTolerance)
+    IFblocks = timed(results, 'AccurateSTFTBlocks', stft_blocks, AccurateSTFTBlocks, data_after_fir,
+                     count=len(data_after_fir), unit='samples')
+    IFsliding = timed(results, 'SlidingSTFTBlocks', stft_blocks, SlidingSTFTBlocks, data_after_fir,
+                      count=len(data_after_fir), unit='samples')
+    error = difference(IFsliding, IFblocks)
+    check(checks, 'SlidingSTFTBlocks - AccurateSTFTBlocks (Hz)', error, error < SlidingTolerance)
+    IFstream = timed(results, 'StreamingENF', stream_enf, bin_path, 'stft', count=events, unit='events')
+    IFsliding = timed(results, 'StreamingENF (sliding)', stream_enf, bin_path, 'sliding', count=events, unit='events')
+    error = difference(IFsliding, IFstream)
+    check(checks, 'StreamingENF sliding - stft (Hz)', error, error < SlidingTolerance)
+    IF = timed(results, 'TDMF', TDMF, IFtest1, 21, 0.02, count=len(IFtest1), unit='samples') / 2
+
+    # ground truth at the centre of every frame
+    truth = synthetic_enf(stream.begin_time / 1e6 + (np.arange(len(IF)) * AStepSize + 1) / ConstFs, seed) - BinBias / 2
+    check(checks, 'estimated ENF MAE (Hz)', np.mean(np.abs(IF - truth)[Edge:-Edge]), np.mean(np.abs(IF - truth)[Edge:-Edge]) < MaxError)
+
+    Archive = ReferenceArchive(record_dir + '/ENF_Reference', 16, 1, 200)
+    IF_ref = timed(results, 'reference ENF', Archive.get_enf, begin - timedelta(seconds=Offset), begin + timedelta(seconds=len(IF) + Offset))
+    IF_ref = IF_ref.astype(np.float64)
+    ref_truth = synthetic_enf(epoch_seconds(begin) - Offset + np.arange(len(IF_ref)), seed) - BinBias
+    ref_error = np.mean(np.abs(IF_ref - ref_truth)[Edge:-Edge])
+    check(checks, 'reference ENF MAE (Hz)', ref_error, ref_error < MaxError)
+
+    lags = len(IF_ref) - len(IF)
+    # the event ENF is halved, so its bin bias is half the reference one, MMSE would see the difference
+    found = timed(results, 'MMSE', MMSE, ConstFs, AStepSize, IF_ref, IF - BinBias / 2, AWindowLength, count=lags, unit='lags')[5]
+    check(checks, 'MMSE offset error (s)', abs(found - Offset), abs(found - Offset) <= 1)
+    found = timed(results, 'PCC', PCC, ConstFs, AStepSize, IF_ref, IF, AWindowLength, count=lags, unit='lags')[5]
+    check(checks, 'PCC offset error (s)', abs(found - Offset), abs(found - Offset) <= 1)
+
+    # pieces of the recording matched all at once, each must get the lag MMSE gives it alone
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, len(IF) // 2, Queries)
+    queries = [IF[i:i + n] - BinBias / 2 for i, n in zip(starts, rng.integers(30, len(IF) // 2, Queries))]
+    matches = timed(results, 'BatchMatch (%d queries)' % Queries, BatchMatch, IF_ref, queries, 'MMSE', 5, -1,
+                    count=sum(len(IF_ref) - len(i) for i in queries), unit='lags')
+    single = [MMSE(ConstFs, AStepSize, IF_ref, i, AWindowLength)[5] for i in queries]
+    disagree = sum(match[0] != lag for match, lag in zip(matches, single))
+    check(checks, 'BatchMatch lags differing from MMSE', disagree, disagree == 0)
+
+    # whole signal against block by block, every frame, on a recording starting with a 0 sample
+    edge_path = write_synthetic_recording(record_dir + '/edge', begin, EdgeSeconds, seed=EdgeSeed)
+    first = event_files_sampling(edge_path, ConstFs)[0]
+    check(checks, 'edge recording first sample', first, first == 0)
+    IFwhole = timed(results, 'estimate_ENF (edge recording)', estimate_ENF, edge_path)
+    IFchunked = timed(results, 'estimate_ENF chunked (edge recording)', lambda: estimate_ENF(edge_path, Chunked=True))
+    error = difference(IFwhole, IFchunked)
+    check(checks, 'estimate_ENF whole - chunked (Hz)', error, error < ChunkedTolerance)
+
+    frames = 30
+    delta_t = 1e6 / 30
+    windows = [stream.window(stream.begin_time + int(n * delta_t), stream.begin_time + int((n + 1) * delta_t)) for n in range(frames)]
+    timed(results, 'event_timesurface (%d frames)' % frames, lambda: [event_timesurface(i) for i in windows], count=frames, unit='frames')
+    return dict(seconds=seconds, events=events, results=results.finish(), checks=checks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every E-ENF stage on synthetic recordings and check the accuracy.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[300, 600, 1200], help='recording lengths in seconds')
+    parser.add_argument('--workdir', default=None, help='folder for the synthetic data, a temporary one by default')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true', help='record the peak memory of every stage, the timings are slower')
+    args = parser.parse_args()
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='enf_benchmark_')
+    runs = []
+    for seconds in args.sizes:
+        run = run_size(seconds, workdir, args.seed, args.trace_memory)
+        runs.append(run)
+        print('\n%d events' % run['events'])
+        print(format_record(run['results']))
+        for record in run['checks']:
+            print('  %-44s %9.5f  %s' % (record['check'], record['value'], 'ok' if record['passed'] else 'FAILED'))
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(runs, f, indent=2)
+    if not all(record['passed'] for run in runs for record in run['checks']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
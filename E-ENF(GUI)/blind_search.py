@@ -0,0 +1,113 @@
+import numpy as np
+from datetime import timedelta
+from sliding_match import SlidingDistance, SlidingPearson, SlidingSums, ValidLags
+
+# ######## Coarse-to-fine blind timestamp search
+# Finds where an estimated ENF (IFtest) sits in a long reference (ENFData) whose relevant part is
+# unknown. Both series are decimated into a pyramid of block means. All lags are scored at the
+# coarsest level with the FFT matchers, and only the best Keep candidates and their neighbourhood
+# are rescored at each finer level. At full resolution the MMSE candidates are ordered by a block-mean
+# lower bound of their squared distance, and exact distances are only computed until that bound
+# exceeds the TopK-th best distance found. NaN gaps in the reference (hours without a wav) never match.
+
+
+def BlockMean(Data, Factor):
+    Length = len(Data) // Factor
+    return Data[:Length * Factor].reshape(Length, Factor).mean(axis=1)
+
+
+def AllLagScores(Data, Query, Metric):
+    Valid = ValidLags(Data, len(Query))
+    Filled = np.where(np.isnan(Data), np.nanmean(Data), Data)
+    if Metric == 'MMSE':
+        Scores = SlidingDistance(Filled, Query) / len(Query)
+        return np.where(Valid, Scores, np.inf)
+    Scores = SlidingPearson(Filled, Query)
+    return np.where(Valid & ~np.isnan(Scores), -Scores, np.inf)
+
+
+def LagScores(Data, Query, Lags, Metric):
+    # exact scores of the given lags, lower is better (PCC scores are negated)
+    Windows = Data[Lags[:, None] + np.arange(len(Query))]
+    if Metric == 'MMSE':
+        Scores = np.sqrt(np.sum((Windows - Query) ** 2, axis=1)) / len(Query)
+    else:
+        Windows = Windows - Windows.mean(axis=1, keepdims=True)
+        Centered = Query - Query.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Scores = -(Windows @ Centered) / np.sqrt(np.sum(Windows ** 2, axis=1) * np.dot(Centered, Centered))
+    return np.where(np.isnan(Scores), np.inf, Scores)
+
+
+def BestLags(Lags, Scores, Count):
+    Count = min(Count, len(Lags))
+    Best = np.argpartition(Scores, Count - 1)[:Count]
+    Best = Best[np.argsort(Scores[Best], kind='stable')]
+    return Lags[Best], Scores[Best]
+
+
+def Neighbourhood(Lags, Factor, LagCount):
+    # lags of the finer level covered by the given coarse lags, one coarse step of margin on each side
+    Lags = (Lags[:, None] * Factor + np.arange(-Factor, 2 * Factor)[None, :]).ravel()
+    return np.unique(Lags[(Lags >= 0) & (Lags < LagCount)])
+
+
+def FinalLags(ENFData, IFtest, Lags, Factor, TopK):
+    # exact MMSE of the candidates in order of their lower bound, stopping once the bound is too high
+    RecordLength = len(IFtest)
+    Blocks = RecordLength // Factor
+    Sums, _ = SlidingSums(np.where(np.isnan(ENFData), 0, ENFData), Factor)
+    QueryMean = BlockMean(IFtest, Factor)
+    Bound = Factor * np.sum((Sums[Lags[:, None] + Factor * np.arange(Blocks)] / Factor - QueryMean) ** 2, axis=1)
+    Order = np.argsort(Bound, kind='stable')
+    Lags, Bound = Lags[Order], Bound[Order]
+
+    FoundLags = np.empty(0, dtype=np.int64)
+    FoundScores = np.empty(0)
+    BatchSize = max(TopK, 16)
+    for i in range(0, len(Lags), BatchSize):
+        if len(FoundScores) >= TopK and Bound[i] > (FoundScores[TopK - 1] * RecordLength) ** 2:
+            break
+        Scores = LagScores(ENFData, IFtest, Lags[i:i + BatchSize], 'MMSE')
+        FoundLags, FoundScores = BestLags(np.append(FoundLags, Lags[i:i + BatchSize]), np.append(FoundScores, Scores), TopK)
+    return FoundLags, FoundScores
+
+
+# Ranked candidate lags (in reference samples) and their scores: MMSE distance as in MMSE(), or the
+# Pearson coefficient as in PCC() when Metric is 'PCC'
+def CoarseToFineSearch(ENFData, IFtest, Metric='MMSE', Levels=3, Factor=4, Keep=64, TopK=10):
+    ENFData = np.asarray(ENFData, dtype=np.float64)
+    IFtest = np.asarray(IFtest, dtype=np.float64)
+    RecordLength = len(IFtest)
+    LagCount = len(ENFData) - RecordLength + 1
+    if LagCount < 1:
+        raise ValueError('the reference is shorter than the query')
+    while Levels > 0 and RecordLength // Factor ** Levels < 8:
+        Levels = Levels - 1
+
+    # coarsest level: every lag
+    Scale = Factor ** Levels
+    Scores = AllLagScores(BlockMean(ENFData, Scale), BlockMean(IFtest, Scale), Metric)
+    Lags, Scores = BestLags(np.arange(len(Scores)), Scores, Keep)
+
+    # finer levels: the neighbourhood of the survivors only
+    for Level in range(Levels - 1, -1, -1):
+        Scale = Factor ** Level
+        Data = BlockMean(ENFData, Scale)
+        Query = BlockMean(IFtest, Scale)
+        Lags = Neighbourhood(Lags, Factor, len(Data) - len(Query) + 1)
+        if Level == 0 and Metric == 'MMSE' and Levels > 0:
+            Lags, Scores = FinalLags(ENFData, IFtest, Lags, Factor, TopK)
+        else:
+            Lags, Scores = BestLags(Lags, LagScores(Data, Query, Lags, Metric), Keep if Level > 0 else TopK)
+
+    Lags, Scores = Lags[np.isfinite(Scores)], Scores[np.isfinite(Scores)]
+    return Lags, (Scores if Metric == 'MMSE' else -Scores)
+
+
+# Ranked candidate start times of a recording in a ReferenceArchive
+def ArchiveSearch(Archive, IF, Metric='MMSE', TopK=10):
+    Archive.build()
+    Lags, Scores = CoarseToFineSearch(np.asarray(Archive.timeline), IF, Metric, TopK=TopK)
+    Times = [Archive.begin_time + timedelta(seconds=int(i) * Archive.step) for i in Lags]
+    return Times, Scores
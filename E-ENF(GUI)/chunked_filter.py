@@ -0,0 +1,92 @@
+import numpy as np
+from scipy import signal
+
+# ######## Chunked zero-phase filtering
+# filtfilt over a signal that arrives block by block, with memory bounded by BlockSize + Overlap:
+# the forward pass runs with its sosfilt state carried between blocks, and the backward pass is run on
+# overlapped blocks, each started from rest Overlap samples after the block so that its start-up
+# transient has died out (a narrow bandpass rings for a few hundred samples) before the samples kept.
+# The ends are handled as in filtfilt: odd extension of PadLength samples and steady-state initial
+# conditions, the last backward block starting from the true end of the signal. Small pushes are
+# gathered into MinBlock samples first, each sosfilt call having a fixed cost.
+class ChunkedFiltFilt:
+    def __init__(self, sos, BlockSize=65536, Overlap=8192, PadLength=None, MinBlock=4096):
+        self.sos = np.asarray(sos)
+        self.BlockSize = BlockSize
+        self.Overlap = Overlap
+        self.MinBlock = MinBlock
+        self.pending = []  # input not yet filtered
+        self.pending_size = 0
+        if PadLength is None:  # what filtfilt uses for the same filter in (b, a) form
+            PadLength = 3 * (2 * len(self.sos) + 1 - min((self.sos[:, 2] == 0).sum(), (self.sos[:, 5] == 0).sum()))
+        self.PadLength = PadLength
+        self.zi = None
+        self.head = np.empty(0)  # input kept until the start extension can be built
+        self.tail = np.empty(0)  # last PadLength + 1 input samples, for the end extension
+        self.forward = []  # forward-filtered blocks not yet filtered backward
+        self.size = 0
+
+    def filter_forward(self, data):
+        if self.zi is None:
+            extension = 2 * data[0] - data[self.PadLength:0:-1]
+            self.zi = signal.sosfilt_zi(self.sos) * extension[0]
+            data = np.concatenate((extension, data))
+            output, self.zi = signal.sosfilt(self.sos, data, zi=self.zi)
+            return output[self.PadLength:]
+        output, self.zi = signal.sosfilt(self.sos, data, zi=self.zi)
+        return output
+
+    # zero-phase samples completed by a new block of input
+    def push(self, data):
+        data = np.asarray(data, dtype=np.float64)
+        if len(data) == 0:
+            return np.empty(0)
+        self.pending.append(data)
+        self.pending_size = self.pending_size + len(data)
+        if self.pending_size < self.MinBlock:
+            return np.empty(0)
+        data = np.concatenate(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        return self.process(data)
+
+    def process(self, data):
+        self.tail = np.concatenate((self.tail, data))[-(self.PadLength + 1):]
+        if self.zi is None:
+            self.head = np.concatenate((self.head, data))
+            if len(self.head) <= self.PadLength:
+                return np.empty(0)
+            data, self.head = self.head, np.empty(0)
+        self.forward.append(self.filter_forward(data))
+        self.size = self.size + len(data)
+        if self.size < self.BlockSize + self.Overlap:
+            return np.empty(0)
+
+        forward = np.concatenate(self.forward)
+        blocks = []
+        while len(forward) >= self.BlockSize + self.Overlap:
+            backward = signal.sosfilt(self.sos, forward[self.BlockSize + self.Overlap - 1::-1])
+            blocks.append(backward[:self.Overlap - 1:-1])
+            forward = forward[self.BlockSize:]
+        self.forward = [forward]
+        self.size = len(forward)
+        return np.concatenate(blocks)
+
+    def finish(self):
+        output = self.process(np.concatenate(self.pending)) if self.pending else np.empty(0)
+        self.pending = []
+        self.pending_size = 0
+        return np.concatenate((output, self.finish_filter()))
+
+    def finish_filter(self):
+        if self.zi is None:  # shorter than the extension, filtered in one go
+            if len(self.head) == 0:
+                return np.empty(0)
+            return signal.sosfiltfilt(self.sos, self.head, padlen=min(self.PadLength, len(self.head) - 1))
+        extension = 2 * self.tail[-1] - self.tail[-2:-(self.PadLength + 2):-1]
+        forward = np.concatenate(self.forward + [self.filter_forward(extension)])
+        zi = signal.sosfilt_zi(self.sos) * forward[-1]
+        backward, zi = signal.sosfilt(self.sos, forward[::-1], zi=zi)
+        self.forward = []
+        self.size = 0
+        return backward[:self.PadLength - 1:-1]
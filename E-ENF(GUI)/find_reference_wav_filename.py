@@ -1,4 +1,5 @@
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 from get_str_date import get_month_str, get_week_str
 
 # ################ find_reference_wav_filename
@@ -110,9 +111,31 @@ def date_wav_filename(ENF_Year, ENF_Month, ENF_date_Begin, ENF_date_End, ENF_Hou
     return storeFileStrings
 
 
+# ################ start time of a recording, from its dvSave-YYYY_MM_DD_HH_MM_SS folder name
+def parse_recording_name(FILENAME):
+    return datetime.strptime(FILENAME[7:26], '%Y_%m_%d_%H_%M_%S')
 
-    
 
+# ################ single-hour reference files
+# A reference file is named after the end of the hour it holds: 2022_08_17_Wed_21_00_00 covers 20:00 - 21:00.
+# The hour ending at midnight is either hour 24 of the same day or hour 00 of the next day.
+def parse_wav_filename(filename):
+    fields = os.path.basename(filename).split('.')[0].split('_')
+    day = datetime.strptime(fields[0] + '-' + fields[1] + '-' + fields[2], '%Y-%m-%d')
+    return day + timedelta(hours=int(fields[4]))
 
 
+def hour_wav_filenames(hour_end):
+    names = [hour_end.strftime('%Y_%m_%d_') + get_week_str(hour_end.weekday()) + hour_end.strftime('_%H_00_00')]
+    if hour_end.hour == 0:
+        day = hour_end - timedelta(days=1)
+        names.append(day.strftime('%Y_%m_%d_') + get_week_str(day.weekday()) + '_24_00_00')
+    return names
 
+
+def find_hour_wav(folder, hour_end):
+    for name in hour_wav_filenames(hour_end):
+        path = folder + '/' + name + '.wav'
+        if os.path.isfile(path):
+            return path
+    return None
@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+StageFields = ('stage', 'wall', 'cpu', 'calls', 'peak_memory', 'max_rss')
+
+# ######## Per-stage metrics of one run
+#   metrics = RunMetrics('dvSave-...')
+#   with metrics.stage('sampling') as stage:
+#       ...
+#       stage['events'], stage['samples'] = n_events, len(Use_data)
+#   record = metrics.finish()
+# Every stage records its wall and CPU seconds (CPU of the thread running it), its number of calls and
+# max_rss, the high-water mark of the process memory in bytes once it is done (not on Windows). With
+# memory=True it also records peak_memory, the peak of the memory traced by tracemalloc while it ran,
+# numpy buffers included; tracing slows the per-packet stages down (about 3x for sampling), so it is
+# opt-in. Any other count a stage sets ('events', 'samples', ...) also gets its rate, events_per_s,
+# samples_per_s. Entering a stage again (block by block processing) adds to it, and the time spent in a stage nested in another is only counted in the inner
+# one (its memory peak counts in both). The run's CPU time is the sum of its stages', as they may run
+# on different threads (the GUI exports the figure on the Tk thread). finish() returns the run as a
+# JSON-ready dict; append_record writes it as one line of a JSON lines file that dashboards can scrape.
+class RunMetrics:
+    def __init__(self, name='', memory=False):
+        self.name = name
+        self.info = dict()  # extra fields of the record (results, options)
+        self.stages = dict()
+        self.stack = []
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.memory = memory and not tracemalloc.is_tracing()
+        if self.memory:
+            tracemalloc.start()
+        self.peak_memory = 0
+        self.begin = time.perf_counter()
+        self.end = None
+        self.final = None
+
+    @contextmanager
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = dict(stage=name, wall=0.0, cpu=0.0, calls=0)
+        record = self.stages[name]
+        peak = self.track_peak()
+        if self.stack:
+            self.stack[-1][4] = max(self.stack[-1][4], peak)
+        frame = [time.perf_counter(), time.thread_time(), 0.0, 0.0, 0]  # start, start cpu, nested wall, cpu and peak
+        self.stack.append(frame)
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - frame[0]
+            cpu = time.thread_time() - frame[1]
+            self.stack.pop()
+            record['wall'] += wall - frame[2]
+            record['cpu'] += cpu - frame[3]
+            record['calls'] += 1
+            peak = max(self.track_peak(), frame[4])
+            if self.memory:
+                record['peak_memory'] = max(record.get('peak_memory', 0), peak)
+            if resource is not None:
+                record['max_rss'] = max_rss()
+            if self.stack:
+                self.stack[-1][2] += wall
+                self.stack[-1][3] += cpu
+                self.stack[-1][4] = max(self.stack[-1][4], peak)
+
+    # peak traced since the last call, which restarts the peak at the current size
+    def track_peak(self):
+        if not self.memory:
+            return 0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        self.peak_memory = max(self.peak_memory, peak)
+        return peak
+
+    def timings(self):
+        timings = {name: record['wall'] for name, record in self.stages.items()}
+        timings['total'] = (self.end if self.end is not None else time.perf_counter()) - self.begin
+        return timings
+
+    def record(self):
+        stages = []
+        for record in self.stages.values():
+            record = dict(record)
+            for count in [i for i in record if i not in StageFields]:
+                record[count + '_per_s'] = record[count] / max(record['wall'], 1e-12)
+            stages.append(record)
+        end = self.end if self.end is not None else time.perf_counter()
+        record = dict(name=self.name, started=self.started, wall=end - self.begin, cpu=sum(i['cpu'] for i in stages))
+        if self.peak_memory > 0:
+            record['peak_memory'] = self.peak_memory
+        if resource is not None:
+            record['max_rss'] = max_rss()
+        record['stages'] = stages
+        record.update(self.info)
+        return record
+
+    def finish(self):
+        if self.end is None:
+            self.track_peak()
+            self.end = time.perf_counter()
+            if self.memory:
+                tracemalloc.stop()
+                self.memory = False
+            self.final = self.record()
+        return self.final
+
+
+def max_rss():
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def append_record(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def format_memory(record):
+    memory = []
+    if 'peak_memory' in record:
+        memory.append('peak %.1f MB' % (record['peak_memory'] / 2 ** 20))
+    if 'max_rss' in record:
+        memory.append('rss %.0f MB' % (record['max_rss'] / 2 ** 20))
+    return '  '.join(memory)
+
+
+def format_record(record):
+    lines = ['%s  %.2f s wall  %.2f s cpu  %s' % (record['name'], record['wall'], record['cpu'], format_memory(record))]
+    width = max([len(i['stage']) for i in record['stages']] + [10])
+    for stage in record['stages']:
+        rates = ['%.3g %s' % (v, k.replace('_per_s', '/s')) for k, v in stage.items() if k.endswith('_per_s')]
+        lines.append('  %-*s %8.3f s wall %8.3f s cpu  %s  %s' % (
+            width, stage['stage'], stage['wall'], stage['cpu'], format_memory(stage), '  '.join(rates)))
+    return '\n'.join(lines)
+
+
+# Opt-in cProfile of the calling thread, the stats are dumped to path (nothing is done when path is None)
+@contextmanager
+def profiled(path):
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
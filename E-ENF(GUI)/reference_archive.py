@@ -0,0 +1,189 @@
+import os
+import re
+import glob
+import hashlib
+from datetime import timedelta
+import numpy as np
+import soundfile as sf
+from AccurateSTFT import AccurateSTFT
+from reference_cache import reference_IF, file_stamp, CacheFolder
+from find_reference_wav_filename import parse_wav_filename
+
+# ######## Reference ENF archive
+# Every YYYY_MM_DD_Www_HH_00_00.wav in an ENF_Reference folder is placed on one contiguous timeline,
+# one IF value per STFT step from the hour before the first file to the end of the last one. Hours
+# without a file stay NaN. The timeline is a memory-mapped .npy in the cache folder and each hour is
+# filled from reference_IF by build(), after which queries are a slice of the map and never open a wav.
+# The values of a query not in the map yet are computed from only the samples they need (read_samples):
+# their span plus half an STFT window on both sides, with frame-offset reads from every hourly file it
+# crosses into one preallocated buffer, and the STFT of that. They are written back into the map, an
+# hour being marked filled once all its values are there, so repeated queries (GUI, batch_ENF) fill the
+# map as they go. Both give the same values, those of one STFT over the joined hours.
+# Each set of wav files and STFT parameters has its own timeline and filled files, so archives with
+# other parameters, or processes still mapping the files of an older set of wavs, are never disturbed;
+# prune() (or build(prune=True)) deletes the older sets of the same parameters once nothing maps them.
+WavPattern = re.compile(r'^\d{4}_\d{2}_\d{2}_[A-Za-z]{3}_\d{2}_00_00\.wav$')
+
+
+class ReferenceArchive:
+    def __init__(self, folder, window=16, step=1, nfft=200):
+        self.folder = folder
+        self.window = window
+        self.step = step
+        self.nfft = nfft
+        names = sorted(i for i in os.listdir(folder) if WavPattern.match(i))
+        if len(names) == 0:
+            raise ValueError('no reference wav files found in {}'.format(folder))
+
+        hour_ends = [parse_wav_filename(i) for i in names]
+        self.begin_time = min(hour_ends) - timedelta(hours=1)
+        self.hours = int((max(hour_ends) - self.begin_time) / timedelta(hours=1))
+        self.hour_length = int(round(3600 / step))
+        self.hour_files = dict()
+        self.rates = dict()  # sample rate of every hour file opened so far
+        for name, hour_end in zip(names, hour_ends):
+            self.hour_files[int((hour_end - self.begin_time) / timedelta(hours=1)) - 1] = folder + '/' + name
+
+        stamp = '|'.join([file_stamp(self.hour_files[i]) for i in sorted(self.hour_files)] + [repr((window, step, nfft))])
+        key = hashlib.sha1(stamp.encode()).hexdigest()[:16]
+        self.cache_folder = folder + '/' + CacheFolder
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        self.parameters = '%g_%g_%g' % (window, step, nfft)
+        timeline_path = self.cache_folder + '/timeline_' + self.parameters + '_' + key + '.npy'
+        filled_path = self.cache_folder + '/filled_' + self.parameters + '_' + key + '.npy'
+        if not os.path.isfile(timeline_path) or not os.path.isfile(filled_path):
+            self.create(timeline_path, filled_path)
+        self.paths = (timeline_path, filled_path)
+        self.timeline = np.load(timeline_path, mmap_mode='r+')
+        self.filled = np.load(filled_path, mmap_mode='r+')
+
+    def create(self, timeline_path, filled_path):
+        for path, dtype, shape, value in ((timeline_path, np.float32, self.hours * self.hour_length, np.nan),
+                                          (filled_path, np.bool_, self.hours, False)):
+            temp_path = path + '.%d.tmp' % os.getpid()
+            data = np.lib.format.open_memmap(temp_path, mode='w+', dtype=dtype, shape=(shape,))
+            data[:] = value
+            data.flush()
+            del data
+            os.replace(temp_path, path)
+
+    def fill_hour(self, hour):
+        IF_ref = reference_IF(self.hour_files[hour], self.window, self.step, self.nfft)
+        size = min(len(IF_ref), self.hour_length)
+        self.timeline[hour * self.hour_length:hour * self.hour_length + size] = IF_ref[:size]
+        self.timeline.flush()
+        self.filled[hour] = True
+        self.filled.flush()
+
+    # Samples of the reference at its native rate from absolute sample first (0 at begin_time) to last
+    # (excluded), zeros where no file exists
+    def read_samples(self, first, last, frequency=None):
+        if frequency is None:
+            frequency = self.samplerate(self.span_hours(first, last, 3600 * self.samplerate([])))
+        hour_samples = 3600 * frequency
+        data = np.zeros(max(last - first, 0))
+        for hour in self.span_hours(first, last, hour_samples):
+            if hour not in self.hour_files:
+                continue
+            begin = max(first, hour * hour_samples)
+            end = min(last, (hour + 1) * hour_samples)
+            # reads straight into the buffer, a file shorter than the hour leaves the zeros behind
+            sf.read(self.hour_files[hour], start=begin - hour * hour_samples, stop=end - hour * hour_samples,
+                    out=data[begin - first:end - first])
+        return data
+
+    # hours holding positions first .. last - 1 of hours of hour_length
+    @staticmethod
+    def span_hours(first, last, hour_length):
+        return range(max(first, 0) // hour_length, (max(last, 0) + hour_length - 1) // hour_length)
+
+    # sample rate of the wavs of the given hours, all of them by default; a wav is only opened once, so a
+    # query only opens the files it reads. With no wav in the hours, that of the first wav.
+    def samplerate(self, hours=None):
+        hours = sorted(self.hour_files) if hours is None else [i for i in hours if i in self.hour_files]
+        if len(hours) == 0:
+            hours = [min(self.hour_files)]
+        for hour in hours:
+            if hour not in self.rates:
+                self.rates[hour] = sf.info(self.hour_files[hour]).samplerate
+        rates = set(self.rates[i] for i in hours)
+        if len(rates) != 1:
+            raise ValueError('reference wav files with different sample rates: {}'.format(sorted(rates)))
+        return rates.pop()
+
+    # IF values first .. last - 1 of the timeline computed from the samples they need only
+    def windowed_enf(self, first, last):
+        # the hours of the span and their neighbours, which the half windows at its ends may reach
+        hours = self.span_hours(first, last, self.hour_length)
+        frequency = self.samplerate(range(hours.start - 1, hours.stop + 1))
+        AWindowLength = int(self.window * frequency)
+        AStepSize = int(self.step * frequency)
+        NFFT = int(self.nfft * frequency)
+        Half = int(AWindowLength / 2)
+        if Half % AStepSize != 0:
+            raise ValueError('half of the STFT window must be a whole number of steps')
+        # frame k is centred on sample k * AStepSize and needs the samples up to Half after it
+        Signal = self.read_samples(first * AStepSize - Half, (last - 1) * AStepSize + Half + 1, frequency)
+        Skip = Half // AStepSize
+        with np.errstate(divide='ignore', invalid='ignore'):  # frames over missing hours may be all zeros
+            return AccurateSTFT(Signal, AWindowLength, AStepSize, frequency, NFFT)[Skip:Skip + last - first].astype(np.float32)
+
+    def build(self, prune=False):
+        for hour in sorted(self.hour_files):
+            if not self.filled[hour]:
+                self.fill_hour(hour)
+        if prune:
+            self.prune()
+
+    # deletes the timelines of older sets of wavs with the same parameters, to be called when no other
+    # process uses them; files still mapped elsewhere (Windows) are left for a later prune
+    def prune(self):
+        for kind in ('timeline_', 'filled_'):
+            for old in glob.glob(self.cache_folder + '/' + kind + self.parameters + '_*.npy'):
+                if old not in self.paths:
+                    try:
+                        os.remove(old)
+                    except OSError:
+                        pass
+
+    @property
+    def final_time(self):
+        return self.begin_time + timedelta(hours=self.hours)
+
+    def index(self, time):
+        return int(round((time - self.begin_time).total_seconds() / self.step))
+
+    # ENF from t_start (included) to t_end (excluded), NaN where no reference exists
+    def get_enf(self, t_start, t_end):
+        first = self.index(t_start)
+        last = self.index(t_end)
+        begin = min(max(first, 0), len(self.timeline))
+        end = max(min(last, len(self.timeline)), begin)
+        enf = np.full(max(last - first, 0), np.nan, dtype=np.float32)
+        span = self.span_hours(begin, end, self.hour_length)
+        enf[begin - first:end - first] = self.timeline[begin:end]
+        # hours without a file stay NaN
+        cached = np.ones(end - begin, dtype=bool)
+        for hour in span:
+            if hour not in self.hour_files:
+                enf[max(hour * self.hour_length, begin) - first:min((hour + 1) * self.hour_length, end) - first] = np.nan
+                cached[max(hour * self.hour_length, begin) - begin:min((hour + 1) * self.hour_length, end) - begin] = True
+            elif not self.filled[hour]:
+                cached[max(hour * self.hour_length, begin) - begin:min((hour + 1) * self.hour_length, end) - begin] = False
+        # values not computed yet (NaN in the timeline) are computed from the samples they need and
+        # written back, so that the next query over them is a slice of the map
+        missing = np.flatnonzero(~cached & np.isnan(enf[begin - first:end - first]))
+        if len(missing) > 0:
+            low, high = begin + missing[0], begin + missing[-1] + 1
+            values = self.windowed_enf(low, high)
+            keep = ~cached[low - begin:high - begin]
+            enf[low - first:high - first][keep] = values[keep]
+            self.timeline[low:high][keep] = values[keep]
+            self.timeline.flush()
+            for hour in self.span_hours(low, high, self.hour_length):
+                if hour in self.hour_files and not self.filled[hour] and \
+                        not np.isnan(self.timeline[hour * self.hour_length:(hour + 1) * self.hour_length]).any():
+                    self.filled[hour] = True
+            self.filled.flush()
+        return enf
@@ -0,0 +1,91 @@
+import os
+import hashlib
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
+import soundfile as sf
+from AccurateSTFT import AccurateSTFT
+from find_reference_wav_filename import parse_wav_filename, find_hour_wav
+
+# ######## Reference ENF cache
+# The IF series of an hourly ENF_Reference wav never changes, so it is computed once at the wav's
+# native rate and kept as float32, one value per STFT step, in <reference folder>/.enf_cache and in a
+# small in-memory LRU. Entries are keyed by the wav path, size and mtime, the STFT parameters and the
+# neighbouring hours, whose edge samples feed the first and last windows of the hour just as they
+# would in one STFT over the joined hours.
+CacheFolder = '.enf_cache'
+MemoryCacheSize = 16
+MemoryCache = OrderedDict()
+
+
+def file_stamp(path):
+    if path is None:
+        return 'None'
+    status = os.stat(path)
+    return '%s:%d:%d' % (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+
+
+# Half a window of samples from the end (tail=True) or the start of a neighbouring hour, zeros if missing
+def read_edge(path, frames, tail):
+    edge = np.zeros(frames)
+    if path is not None:
+        if tail:
+            data, frequency = sf.read(path, start=-frames)
+            edge[frames - len(data):] = data
+        else:
+            data, frequency = sf.read(path, frames=frames)
+            edge[:len(data)] = data
+    return edge
+
+
+def compute_reference_IF(wav_path, previous, following, AWindowLength, AStepSize, NFFT):
+    data_ref, frequency = sf.read(wav_path)
+    Half = int(AWindowLength / 2)
+    Signal = np.concatenate((read_edge(previous, Half, True), data_ref, read_edge(following, Half, False)))
+    # the edges shift the STFT by Half / AStepSize frames, one frame per step of the hour is kept
+    Skip = Half // AStepSize
+    with np.errstate(divide='ignore', invalid='ignore'):  # the dropped frames may be all zeros
+        IF_ref = AccurateSTFT(Signal, AWindowLength, AStepSize, frequency, NFFT)
+    return IF_ref[Skip:Skip + int(np.ceil(len(data_ref) / AStepSize))].astype(np.float32)
+
+
+# IF series of one reference wav, window / step / nfft are given in seconds as in the GUI
+def reference_IF(wav_path, window=16, step=1, nfft=200, cache_folder=None):
+    frequency = sf.info(wav_path).samplerate
+    AWindowLength = int(window * frequency)
+    AStepSize = int(step * frequency)
+    NFFT = int(nfft * frequency)
+    if int(AWindowLength / 2) % AStepSize != 0:
+        raise ValueError('half of the STFT window must be a whole number of steps')
+
+    folder = os.path.dirname(os.path.abspath(wav_path))
+    hour_end = parse_wav_filename(wav_path)
+    previous = find_hour_wav(folder, hour_end - timedelta(hours=1))
+    following = find_hour_wav(folder, hour_end + timedelta(hours=1))
+    stamp = '|'.join([file_stamp(wav_path), file_stamp(previous), file_stamp(following),
+                      '%d %d %d' % (AWindowLength, AStepSize, NFFT)])
+    key = hashlib.sha1(stamp.encode()).hexdigest()[:16]
+
+    if key in MemoryCache:
+        MemoryCache.move_to_end(key)
+        return MemoryCache[key]
+
+    if cache_folder is None:
+        cache_folder = folder + '/' + CacheFolder
+    cache_path = cache_folder + '/' + os.path.basename(wav_path).split('.')[0] + '_' + key + '.npy'
+    if os.path.isfile(cache_path):
+        IF_ref = np.load(cache_path)
+    else:
+        IF_ref = compute_reference_IF(wav_path, previous, following, AWindowLength, AStepSize, NFFT)
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+        temp_path = cache_path + '.%d.tmp' % os.getpid()
+        with open(temp_path, 'wb') as f:
+            np.save(f, IF_ref)
+        os.replace(temp_path, cache_path)
+
+    IF_ref.flags.writeable = False
+    MemoryCache[key] = IF_ref
+    if len(MemoryCache) > MemoryCacheSize:
+        MemoryCache.popitem(last=False)
+    return IF_ref
@@ -0,0 +1,82 @@
+import numpy as np
+from scipy.signal import fftconvolve
+
+# ######## All-lag comparison of a query ENF against a longer reference ENF
+# Lag i compares ENFData[i:i + len(IFtest)] with IFtest. Every lag comes from one FFT
+# cross-correlation plus running sums of the reference, O(N log N) instead of O(N * M).
+# NaN gaps in the reference (hours without a wav) are filled for the sums and the correlation, and
+# every lag whose window touches a gap scores NaN.
+FlatVariance = 1e-9  # windows whose variance is below this fraction of their energy have no correlation
+
+
+def SlidingSums(Data, Length):
+    # Sum and sum of squares of every window of Length samples
+    CumSum = np.concatenate(([0.0], np.cumsum(Data)))
+    CumSquare = np.concatenate(([0.0], np.cumsum(Data * Data)))
+    return CumSum[Length:] - CumSum[:-Length], CumSquare[Length:] - CumSquare[:-Length]
+
+
+def ValidLags(Data, RecordLength):
+    # lags whose window holds no NaN
+    Gaps, _ = SlidingSums(np.isnan(Data).astype(np.float64), RecordLength)
+    return Gaps < 0.5
+
+
+def FillGaps(Data):
+    # Data with its NaN gaps set to the mean of the other samples
+    Gaps = np.isnan(Data)
+    if not Gaps.any():
+        return Data
+    return np.where(Gaps, np.mean(Data[~Gaps]) if not Gaps.all() else 0.0, Data)
+
+
+def CrossCorrelation(Data, Query):
+    # sum(Data[i:i + len(Query)] * Query) for every lag i
+    return fftconvolve(Data, Query[::-1], mode='valid')
+
+
+def SlidingDistance(ENFData, IFtest):
+    # Euclidean distance between every reference window and the query. Both series are shifted by the
+    # reference mean first, which leaves the distances unchanged and keeps the running sums well conditioned
+    ENFData = np.asarray(ENFData, dtype=np.float64)
+    IFtest = np.asarray(IFtest, dtype=np.float64)
+    Filled = FillGaps(ENFData)
+    Offset = np.mean(Filled)
+    Data = Filled - Offset
+    Query = IFtest - Offset
+    _, Energy = SlidingSums(Data, len(Query))
+    Square = Energy - 2 * CrossCorrelation(Data, Query) + np.dot(Query, Query)
+    Distance = np.sqrt(np.maximum(Square, 0))
+    if Filled is not ENFData:
+        Distance[~ValidLags(ENFData, len(Query))] = np.nan
+    return Distance
+
+
+def SlidingPearson(ENFData, IFtest):
+    # Pearson correlation coefficient between every reference window and the query, NaN for flat
+    # windows, whose variance is lost in the rounding of the running sums
+    ENFData = np.asarray(ENFData, dtype=np.float64)
+    IFtest = np.asarray(IFtest, dtype=np.float64)
+    RecordLength = len(IFtest)
+    Filled = FillGaps(ENFData)
+    Data = Filled - np.mean(Filled)
+    Query = IFtest - np.mean(IFtest)
+    Sum, Energy = SlidingSums(Data, RecordLength)
+    Covariance = CrossCorrelation(Data, Query)
+    WindowVariance = Energy - Sum * Sum / RecordLength
+    Variance = np.maximum(WindowVariance, 0) * np.dot(Query, Query)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Pearson = np.clip(Covariance / np.sqrt(Variance), -1, 1)
+    Pearson[WindowVariance <= FlatVariance * Energy] = np.nan
+    if Filled is not ENFData:
+        Pearson[~ValidLags(ENFData, RecordLength)] = np.nan
+    return Pearson
+
+
+def TopLags(Scores, TopK, Largest):
+    # Indices of the TopK best scores, best first, and their scores
+    Order = np.where(np.isnan(Scores), np.inf, -Scores if Largest else Scores)
+    TopK = min(TopK, len(Order))
+    TopIndex = np.argpartition(Order, TopK - 1)[:TopK]
+    TopIndex = TopIndex[np.argsort(Order[TopIndex], kind='stable')]
+    return TopIndex, Scores[TopIndex]
@@ -0,0 +1,26 @@
+import os
+from datetime import timedelta
+import numpy as np
+import soundfile as sf
+import DV_data  # puts Event_Process on the path
+from synthetic_events import synthetic_enf, epoch_seconds
+from find_reference_wav_filename import hour_wav_filenames
+
+# ######## Synthetic ENF_Reference
+# Hourly wav files of a mains voltage following synthetic_enf, named after the end of their hour as the
+# EV-ENFD files are, so that recordings written by synthetic_events with the same seed match them.
+def write_synthetic_reference(folder, first_hour_end, hours, fs=400, seed=0, noise=0.01):
+    rng = np.random.default_rng(seed + 2)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    phase = 0.0
+    paths = []
+    for hour in range(hours):
+        hour_end = first_hour_end + timedelta(hours=hour)
+        t = epoch_seconds(hour_end - timedelta(hours=1)) + np.arange(3600 * fs) / fs
+        voltage_phase = phase + 2 * np.pi * np.cumsum(synthetic_enf(t, seed)) / fs
+        phase = voltage_phase[-1]
+        voltage = np.sin(voltage_phase) + noise * rng.standard_normal(len(t))
+        paths.append(folder + '/' + hour_wav_filenames(hour_end)[0] + '.wav')
+        sf.write(paths[-1], voltage.astype(np.float32), fs)
+    return paths
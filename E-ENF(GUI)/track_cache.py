@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# ######## Cache of the ENF tracks of recordings
+# Sampling, filtering and the STFT of a recording only depend on its event files and the parameters,
+# so their results are kept in a .npz file per entry, in <folder of the recordings>/.enf_cache:
+#   'signal'  the 1 kHz sampled signal, polarity samples packed to one bit each
+#   'IF'      the final ENF track, after TDMF
+# An entry is keyed by the sha1 of the stamps (path, size, mtime) of every event file of the recording
+# and of the exact parameters of its kind, so a signal entry is reused when only the STFT or TDMF
+# parameters change. The files are not hashed themselves, a multi-GB recording would take longer to
+# hash than to sample; rewriting a file changes its mtime. Hits are touched, and the least recently
+# used entries are deleted once the folder is larger than MaxBytes.
+CacheFolder = '.enf_cache'
+MaxBytes = 512 * 2 ** 20
+
+
+def file_stamp(path):
+    status = os.stat(path)
+    return '%s:%d:%d' % (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+
+
+# stamps of an 'events' folder (binary store columns and index, or events{i}.txt files) or an aedat4 file
+def source_stamp(events_path):
+    if os.path.isdir(events_path):
+        return [file_stamp(events_path + '/' + i) for i in sorted(os.listdir(events_path))
+                if os.path.isfile(events_path + '/' + i)]
+    return [file_stamp(events_path)]
+
+
+# Events/Unpacked/.enf_cache for Events/Unpacked/dvSave-*/events, Events/Raw/.enf_cache for Events/Raw/dvSave-*.aedat4
+def default_cache_folder(events_path):
+    events_path = os.path.abspath(events_path.rstrip('/'))
+    if os.path.isdir(events_path):
+        return os.path.dirname(os.path.dirname(events_path)) + '/' + CacheFolder
+    return os.path.dirname(events_path) + '/' + CacheFolder
+
+
+class TrackCache:
+    def __init__(self, folder, max_bytes=MaxBytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(kind, source, parameters):
+        stamp = json.dumps([kind, source, parameters], sort_keys=True)
+        return kind + '_' + hashlib.sha1(stamp.encode()).hexdigest()[:20]
+
+    def path(self, key):
+        return self.folder + '/' + key + '.npz'
+
+    def load_signal(self, key):
+        entry = self.load(key)
+        if entry is None:
+            return None
+        # float64 as sampled, filtfilt would compute its edge extension in uint8
+        if 'bits' in entry:
+            return np.unpackbits(entry['bits'], count=int(entry['length'])).astype(np.float64)
+        return entry['signal'].astype(np.float64)
+
+    def save_signal(self, key, signal):
+        if np.all((signal == 0) | (signal == 1)):
+            self.save(key, bits=np.packbits(signal.astype(np.uint8)), length=np.array(len(signal)))
+        else:
+            self.save(key, signal=signal)
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            os.utime(path)
+        except (OSError, ValueError):  # missing, evicted meanwhile or truncated
+            return None
+        return arrays
+
+    def save(self, key, **arrays):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        temp_path = self.path(key) + '.%d.tmp' % os.getpid()
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.npz'):
+                try:
+                    status = os.stat(self.folder + '/' + name)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime_ns, status.st_size, name))
+        entries.sort()
+        total = sum(i[1] for i in entries)
+        for mtime, size, name in entries[:-1]:  # the newest entry is kept even if alone it is too large
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.folder + '/' + name)
+            except OSError:
+                pass
+            total = total - size
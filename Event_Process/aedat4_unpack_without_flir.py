@@ -1,47 +1,148 @@
 from dv import AedatFile
 import os
+import sys
+import json
+import shutil
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from event_visualize import events2timesurfaces
+from event_store import EventStoreWriter
 from os.path import dirname, abspath
 
+# ######## Parallel, resumable unpacking
+# Every aedat4 file of data_path is unpacked by its own worker process into save_path/<name>/events.
+# The events are first written to events.partial, committed every CommitEvery packets, and the folder is
+# renamed to events once the file is complete. save_path/unpack_manifest.json records the completed
+# files (source size and mtime, packets, events, time surfaces), so a new run skips them, and an
+# interrupted file resumes from its last committed packet. Time surfaces are only pre-rendered with
+# if_visualize, timesurface_frames.py renders the frames that are looked at on demand.
+MANIFEST_FILENAME = 'unpack_manifest.json'
+CommitEvery = 64
 
-def unpack(data_path: object, save_path: object, if_visualize: object = True) -> object:
+
+def source_stamp(file_path):
+    status = os.stat(file_path)
+    return '%d:%d' % (status.st_size, status.st_mtime_ns)
+
+
+def load_manifest(save_path):
+    manifest_path = save_path + '/' + MANIFEST_FILENAME
+    if not os.path.isfile(manifest_path):
+        return dict()
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def unpack(data_path: object, save_path: object, if_visualize: object = False, workers=None) -> object:
     file_type_list = ['aedat4']
-    os.chdir(data_path)
-    aedatfiles = os.listdir()
-    for filename in aedatfiles:
+    data_path = abspath(data_path)
+    save_path = abspath(save_path)
+    manifest = load_manifest(save_path)
+    jobs = []
+    for filename in sorted(os.listdir(data_path)):
         file_type = filename.split('.')[-1]
         if (file_type in file_type_list):
-            os.chdir(data_path)
-            # 1. unpacking files
-            unpack_events_file(filename, save_path)
-            # 2. time_surface
-            file_name = os.path.basename(filename).split('.')[0]
-            files = save_path + '/' + file_name
-            events2timesurfaces(files, fps = 30)
+            file_path = data_path + '/' + filename
+            file_name = filename.split('.')[0]
+            entry = manifest.get(file_name)
+            if entry is not None and entry['source'] == source_stamp(file_path) \
+                    and os.path.isdir(save_path + '/' + file_name + '/events') \
+                    and (entry.get('timesurfaces') or not if_visualize):
+                print(file_name, 'already unpacked')
+                continue
+            jobs.append((file_path, file_name, entry))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(unpack_recording, file_path, save_path, if_visualize, entry): file_name
+                   for file_path, file_name, entry in jobs}
+        for future in as_completed(futures):
+            try:
+                manifest[futures[future]] = future.result()
+            except Exception as error:
+                print(futures[future], 'failed,', error)
+                continue
+            save_json(save_path + '/' + MANIFEST_FILENAME, manifest)
 
     print('All Done')
 
 
-
-def unpack_events_file(file_path, save_path):
+# 1. unpacking files, 2. time_surface, skipping what the manifest entry says is done
+def unpack_recording(file_path, save_path, if_visualize=True, entry=None):
+    file_name = os.path.basename(file_path).split('.')[0]
+    if entry is None or entry['source'] != source_stamp(file_path):
+        entry = dict(source=source_stamp(file_path))
+    if not os.path.isdir(save_path + '/' + file_name + '/events') or 'packets' not in entry:
+        entry['packets'], entry['events'] = unpack_events_file(file_path, save_path)
+        entry.pop('timesurfaces', None)
+    if if_visualize and not entry.get('timesurfaces'):
+        # the files are already spread over the workers, each renders its frames in one process
+        events2timesurfaces(save_path + '/' + file_name, fps = 30, workers=1)
+        entry['timesurfaces'] = True
+    return entry
+
+
+# Returns the number of packets and events of the file
+def unpack_events_file(file_path, save_path, event_format='bin'):
     file_name = os.path.basename(file_path).split('.')[0]
     print(file_name)
-    if not os.path.exists(save_path + '/' + file_name):
-        os.mkdir(save_path +  '/' + file_name)
-    if not os.path.exists(save_path + '/' + file_name + '/events'):
-        os.mkdir(save_path + '/' + file_name + '/events')
-    i = 0
+    events_path = save_path + '/' + file_name + '/events'
+    temp_path = events_path + '.partial'
+    progress_path = temp_path + '/progress.json'
+
+    # a partial unpack of another version of the file is started again
+    stamp = dict(source=source_stamp(file_path), format=event_format, packets=0, committed=0)
+    progress = stamp
+    if os.path.isfile(progress_path):
+        with open(progress_path) as f:
+            progress = json.load(f)
+        if progress['source'] != stamp['source'] or progress['format'] != event_format:
+            progress = stamp
+    if progress is stamp and os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    if not os.path.exists(temp_path):
+        os.makedirs(temp_path)
+
+    packets = 0
     with AedatFile(file_path) as f:
-        for e in f['events'].numpy():
-            events = np.array([e['timestamp'] / 1e6, e['x'], e['y'], e['polarity']]).T
-        # write event data
-            event_file = open(save_path + '/' + file_name + '/events' + '/events{}.txt'.format(i), 'w+')
-            for j in range(len(events)):
-                event_file.write('%f %d %d %d\n' % (events[j, 0], events[j, 1], events[j, 2], events[j, 3]))
-            event_file.close()
-            i = i +1
+        if event_format == 'bin':
+            # write event data, one bulk append per packet
+            with EventStoreWriter(temp_path, resume=progress['committed']) as writer:
+                for e in f['events'].numpy():
+                    packets = packets + 1
+                    if packets <= progress['packets']:
+                        continue
+                    writer.append(e['timestamp'], e['x'], e['y'], e['polarity'])
+                    if packets % CommitEvery == 0:
+                        writer.commit()
+                        progress.update(packets=packets, committed=len(writer.index))
+                        save_json(progress_path, progress)
+                events = writer.offset
+        else:
+            events = 0
+            for e in f['events'].numpy():
+                txt_path = temp_path + '/events{}.txt'.format(packets)
+                packets = packets + 1
+                events = events + len(e)
+                if os.path.isfile(txt_path):
+                    continue
+                events_array = np.array([e['timestamp'] / 1e6, e['x'], e['y'], e['polarity']]).T
+                np.savetxt(txt_path + '.tmp', events_array, fmt='%f %d %d %d')
+                os.replace(txt_path + '.tmp', txt_path)
+
+    if os.path.isfile(progress_path):
+        os.remove(progress_path)
+    if os.path.exists(events_path):
+        shutil.rmtree(events_path)
+    os.replace(temp_path, events_path)
     print('To Events Done')
+    return packets, events
 
 
 
@@ -50,13 +151,4 @@ if __name__ == '__main__':
     path = dirname(dirname(abspath(__file__)))
     data_path = path + '/Events/Raw'
     save_path = path + '/Events/Unpacked'
-    unpack(data_path, save_path)
-
-
-
-
-
-
-
-
-
+    unpack(data_path, save_path, if_visualize='--visualize' in sys.argv)
@@ -0,0 +1,52 @@
+import numpy as np
+
+# ######## EventBatch
+# Events of a packet or a time window as four columns, the dtypes of the binary event store:
+#   t int64 micro-seconds, x uint16 column, y uint16 row, p uint8 polarity
+# 13 bytes per event. Slicing, window and the columns of an EventBatch built on arrays of these dtypes
+# are views, nothing is copied; only concatenate copies, for windows spanning several txt packets.
+# A batch unpacks as t, x, y, p, and batch['x'] / batch['size'] still work for the old dict windows.
+class EventBatch:
+    __slots__ = ('t', 'x', 'y', 'p')
+    dtypes = (np.int64, np.uint16, np.uint16, np.uint8)
+
+    def __init__(self, t, x, y, p):
+        self.t = np.asarray(t, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.uint16)
+        self.y = np.asarray(y, dtype=np.uint16)
+        self.p = np.asarray(p, dtype=np.uint8)
+
+    @classmethod
+    def empty(cls):
+        return cls(*(np.empty((0,), dtype=dtype) for dtype in cls.dtypes))
+
+    @classmethod
+    def concatenate(cls, batches):
+        if len(batches) == 1:
+            return batches[0]
+        if len(batches) == 0:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(batch, name) for batch in batches]) for name in cls.__slots__))
+
+    def __len__(self):
+        return len(self.t)
+
+    @property
+    def size(self):
+        return len(self.t)
+
+    @property
+    def nbytes(self):
+        return self.t.nbytes + self.x.nbytes + self.y.nbytes + self.p.nbytes
+
+    def __iter__(self):
+        return iter((self.t, self.x, self.y, self.p))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return len(self.t) if key == 'size' else getattr(self, key)
+        return EventBatch(self.t[key], self.x[key], self.y[key], self.p[key])
+
+    # events with t0 <= t < t1
+    def window(self, t0, t1):
+        return self[np.searchsorted(self.t, t0, 'left'):np.searchsorted(self.t, t1, 'left')]
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+
+# ######## Binary event store
+# A recording is stored column by column in one folder:
+#   t.bin  int64   timestamp in micro-seconds
+#   x.bin  uint16  column
+#   y.bin  uint16  row
+#   p.bin  uint8   polarity
+#   index.npy      one row per aedat4 packet: [first event, number of events, first timestamp, last timestamp]
+# Each packet is appended in bulk, and readers open the columns with memory mapping.
+EVENT_COLUMNS = (('t', np.int64), ('x', np.uint16), ('y', np.uint16), ('p', np.uint8))
+INDEX_FILENAME = 'index.npy'
+
+
+def is_event_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILENAME))
+
+
+# resume=n reopens a store written before and keeps its first n committed packets, dropping anything
+# appended after them; the index is rewritten (atomically) by commit() and close()
+class EventStoreWriter:
+    def __init__(self, path, resume=None):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.index = []
+        self.offset = 0
+        if resume is not None and is_event_store(path):
+            self.index = [tuple(i) for i in load_event_index(path)[:resume]]
+            if len(self.index) > 0:
+                self.offset = int(self.index[-1][0] + self.index[-1][1])
+        self.files = dict()
+        for name, dtype in EVENT_COLUMNS:
+            column_path = os.path.join(path, name + '.bin')
+            if len(self.index) > 0 and os.path.isfile(column_path):
+                self.files[name] = open(column_path, 'r+b')
+                self.files[name].truncate(self.offset * np.dtype(dtype).itemsize)
+                self.files[name].seek(0, os.SEEK_END)
+            else:
+                self.files[name] = open(column_path, 'wb')
+
+    def append(self, t, x, y, p):
+        size = len(t)
+        if size == 0:
+            return
+        for (name, dtype), column in zip(EVENT_COLUMNS, (t, x, y, p)):
+            np.ascontiguousarray(column, dtype=dtype).tofile(self.files[name])
+        self.index.append((self.offset, size, t[0], t[-1]))
+        self.offset += size
+
+    def commit(self):
+        for f in self.files.values():
+            f.flush()
+        index = np.array(self.index, dtype=np.int64).reshape(-1, 4)
+        temp_path = os.path.join(self.path, INDEX_FILENAME + '.tmp')
+        with open(temp_path, 'wb') as f:
+            np.save(f, index)
+        os.replace(temp_path, os.path.join(self.path, INDEX_FILENAME))
+
+    def close(self):
+        self.commit()
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_event_index(path):
+    return np.load(os.path.join(path, INDEX_FILENAME))
+
+
+# Returns the memory-mapped columns of the whole recording and the packet index
+def open_event_store(path):
+    index = load_event_index(path)
+    size = int(index[-1, 0] + index[-1, 1]) if len(index) else 0
+    columns = dict()
+    for name, dtype in EVENT_COLUMNS:
+        if size == 0:
+            columns[name] = np.empty((0,), dtype=dtype)
+        else:
+            columns[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=(size,))
+    return columns, index
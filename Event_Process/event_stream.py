@@ -0,0 +1,105 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from event_store import is_event_store, open_event_store
+from event_batch import EventBatch
+
+TxtColumns = np.dtype([('t', np.float64), ('x', np.uint16), ('y', np.uint16), ('p', np.uint8)])
+
+
+# ######## Read one events{i}.txt file, timestamps are converted to micro-seconds
+# The columns are parsed straight into their dtypes (15 bytes per event), not into a float64 matrix,
+# and copied out into contiguous columns (13 bytes per event) so that the parsed records are freed
+def read_txt_events(path):
+    events = np.loadtxt(path, dtype=TxtColumns, ndmin=1)
+    return EventBatch(np.rint(events['t'] * 1e6), *(np.ascontiguousarray(events[name]) for name in ('x', 'y', 'p')))
+
+
+# First and last timestamps of an events{i}.txt file, read without parsing the whole file
+def txt_time_range(path):
+    with open(path, 'rb') as f:
+        first = f.readline()
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 256))
+        last = f.read().splitlines()[-1]
+    return int(round(float(first.split()[0]) * 1e6)), int(round(float(last.split()[0]) * 1e6))
+
+
+# ######## Time-indexed stream over every packet of a recording
+# path is an 'events' folder (binary event store or events{i}.txt files) or a single events{i}.txt file.
+# All times are micro-seconds; windows are found with binary search on the chunk time ranges and
+# on the timestamps inside each chunk, so packet boundaries are invisible to the caller. Packets and
+# windows are EventBatch; those of a binary event store are views of its memory-mapped columns.
+class EventStream:
+    def __init__(self, path, cache_size=2):
+        self.columns = None
+        self.paths = None
+        if os.path.isdir(path) and is_event_store(path):
+            self.columns, index = open_event_store(path)
+            self.chunk_offset = index[:, 0]
+            self.chunk_size = index[:, 1]
+            self.chunk_begin = index[:, 2]
+            self.chunk_final = index[:, 3]
+        else:
+            if os.path.isdir(path):
+                path_list = [i for i in os.listdir(path) if i.endswith('.txt')]
+                path_list.sort(key=lambda x: int(x[6:-4]))
+                self.paths = [path + '/' + i for i in path_list if os.path.getsize(path + '/' + i) > 0]
+            else:
+                self.paths = [path]
+            ranges = np.array([txt_time_range(i) for i in self.paths], dtype=np.int64).reshape(-1, 2)
+            self.chunk_begin = ranges[:, 0]
+            self.chunk_final = ranges[:, 1]
+        if len(self.chunk_begin) == 0:
+            raise ValueError('no events found in {}'.format(path))
+
+        self.begin_time = int(self.chunk_begin[0])
+        self.final_time = int(self.chunk_final[-1])
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.chunk_begin)
+
+    # EventBatch of one packet
+    def chunk(self, i):
+        if self.columns is not None:
+            return self.span(self.chunk_offset[i], self.chunk_offset[i] + self.chunk_size[i])
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+        columns = read_txt_events(self.paths[i])
+        self.cache[i] = columns
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return columns
+
+    # events begin .. end - 1 of a binary event store
+    def span(self, begin, end):
+        return EventBatch(*(self.columns[name][begin:end] for name in EventBatch.__slots__))
+
+    def chunks(self):
+        for i in range(len(self)):
+            yield self.chunk(i)
+
+    # events with t0 <= t < t1, a view even across packets for a binary event store
+    def window(self, t0, t1):
+        first = np.searchsorted(self.chunk_final, t0, 'left')
+        last = np.searchsorted(self.chunk_begin, t1, 'left')
+        if first >= last:
+            return EventBatch.empty()
+        if self.columns is not None:
+            begin = self.chunk_offset[first] + np.searchsorted(self.chunk(first).t, t0, 'left')
+            end = self.chunk_offset[last - 1] + np.searchsorted(self.chunk(last - 1).t, t1, 'left')
+            return self.span(begin, end)
+        return EventBatch.concatenate([self.chunk(i).window(t0, t1) for i in range(first, last)])
+
+    # events sharing the latest timestamp that is not after t
+    def latest(self, t):
+        i = max(np.searchsorted(self.chunk_begin, t, 'right') - 1, 0)
+        timestamp = self.chunk(i).t
+        idx = np.searchsorted(timestamp, t, 'right') - 1
+        if idx < 0:
+            return self.window(t, t)
+        return self.window(timestamp[idx], timestamp[idx] + 1)
@@ -1,46 +1,78 @@
-import numpy as np
 import cv2
 import os
-from read_txt import Event_txt_loader, event_timesurface
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from event_stream import EventStream
+from timesurface import TimeSurfaceRenderer
 from tqdm import tqdm
 
+BatchFrames = 64  # frames rendered by a worker at once
+
+
+def frame_count(stream, fps):
+    return int((stream.final_time - stream.begin_time) // (1e6 / fps))
 
 
-# the event data is converted into a timesurface set
-def events2timesurfaces(source_path, fps=30):
-    path = source_path + '/events'
-    path_list = os.listdir(path)
-    path_list.sort(key=lambda x: int(x[6:-4]))
-    events_finish = dict()
-    j = 0
+# Frames first_frame .. last_frame - 1, one per 1/fps window; windows crossing a packet boundary are
+# served by the stream. They are written into the frame stack at stack_path when given, else returned.
+def render_frames(events_path, first_frame, last_frame, fps=30, stack_path=None, img_height=480, img_width=640):
+    stream = EventStream(events_path)
+    renderer = TimeSurfaceRenderer(img_height, img_width)
+    if stack_path is None:
+        frames = np.empty((last_frame - first_frame, img_height, img_width, 3), dtype=np.uint8)
+    else:
+        frames = np.load(stack_path, mmap_mode='r+')[first_frame:last_frame]
+    delta_t = 1e6 / fps
+    for n in range(first_frame, last_frame):
+        events = stream.window(stream.begin_time + int(n * delta_t), stream.begin_time + int((n + 1) * delta_t))
+        renderer.render(events.x, events.y, events.p, frames[n - first_frame])
+    if stack_path is None:
+        return frames
+    frames.flush()
+
+
+# the event data is converted into a timesurface set, stored as one container in the recording folder:
+#   'video'  event2ts.mp4, compressed
+#   'npy'    event2ts.npy, a raw (frames, 480, 640, 3) uint8 stack to open with np.load(..., mmap_mode='r'),
+#            0.9 MB per frame (about 100 GB per hour at 30 fps), opt-in for random access
+#   'png'    event2ts/%06d.png, one file per frame as before
+# Batches of frames are rendered by worker processes; the container is written under a temporary name
+# and renamed once complete.
+def events2timesurfaces(source_path, fps=30, output='video', workers=None):
+    stream = EventStream(source_path + '/events')
     img_height = 480
     img_width = 640
-    n = 0
-    for i in tqdm(path_list):
-        fliename = path + '/' + i
-        event2ts_save_path = source_path + '/event2ts'
-        if not os.path.exists(event2ts_save_path):
-            os.mkdir(event2ts_save_path)
-        events_loader = Event_txt_loader(fliename)
-        if j == 0:
-            current_time = events_loader.begin_time  #####  select first current_time
-            event_fromal = dict()
-            j = 1
-        while True:
-            if j == 1 and current_time < events_loader.begin_time:
-                event_fromal = event_fromal
-            else:
-                event_fromal = dict()
-            events, current_time = events_loader.files_load_delta_t(1 / fps, current_time)
-            if events_loader.done:
-                event_fromal = events
-                break
-            if event_fromal:
-                combined_keys = event_fromal.keys() | events.keys()
-                combined_keys.remove('size')
-                events = {key: np.hstack((event_fromal[key],events[key])) for key in combined_keys}
-            img = event_timesurface(events, img_height, img_width)
-            cv2.imwrite(event2ts_save_path + '/%06d.png' % n, img)
-            n += 1
-        cv2.destroyAllWindows()
-    print('To Timesurfaces Done')
\ No newline at end of file
+    n_frames = frame_count(stream, fps)
+    batches = [(i, min(i + BatchFrames, n_frames)) for i in range(0, n_frames, BatchFrames)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if output == 'npy':
+            save_path = source_path + '/event2ts.npy'
+            temp_path = save_path + '.partial'
+            stack = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=(n_frames, img_height, img_width, 3))
+            del stack
+            jobs = [pool.submit(render_frames, source_path + '/events', i, j, fps, temp_path) for i, j in batches]
+            for job in tqdm(jobs):
+                job.result()
+            os.replace(temp_path, save_path)
+        elif output == 'video':
+            save_path = source_path + '/event2ts.mp4'
+            temp_path = source_path + '/event2ts.partial.mp4'
+            writer = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (img_width, img_height))
+            jobs = pool.map(render_frames, [source_path + '/events'] * len(batches), *zip(*batches), [fps] * len(batches))
+            for frames in tqdm(jobs, total=len(batches)):
+                for img in frames:
+                    writer.write(img)
+            writer.release()
+            os.replace(temp_path, save_path)
+        else:
+            event2ts_save_path = source_path + '/event2ts'
+            if not os.path.exists(event2ts_save_path):
+                os.mkdir(event2ts_save_path)
+            jobs = pool.map(render_frames, [source_path + '/events'] * len(batches), *zip(*batches), [fps] * len(batches))
+            n = 0
+            for frames in tqdm(jobs, total=len(batches)):
+                for img in frames:
+                    cv2.imwrite(event2ts_save_path + '/%06d.png' % n, img)
+                    n = n + 1
+    print('To Timesurfaces Done')
@@ -0,0 +1,65 @@
+import os
+import calendar
+import numpy as np
+from event_store import EventStoreWriter
+
+# ######## Synthetic event recordings
+# A lamp on the mains flickers at twice the ENF. synthetic_enf is the ground-truth ENF at any absolute
+# time (seconds since the epoch): a few slow random oscillations around 50 Hz, the same for a given seed,
+# so recordings and references generated separately agree. A synthetic recording has pixels of a flicker
+# region firing with a polarity that follows the 100 Hz flicker, plus noise events of random polarity
+# all over the sensor, written as save_path/dvSave-YYYY_MM_DD_HH_MM_SS/events in the binary event store
+# ('bin') or the events{i}.txt layout ('txt'). Timestamps are micro-seconds since the epoch.
+def synthetic_enf(t, seed=0, nominal=50.0):
+    rng = np.random.default_rng(seed)
+    periods = rng.uniform(120, 3600, 8)
+    amplitudes = rng.uniform(0.002, 0.012, 8)
+    phases = rng.uniform(0, 2 * np.pi, 8)
+    t = np.asarray(t, dtype=np.float64)
+    return nominal + np.sum(amplitudes[:, None] * np.sin(2 * np.pi * np.ravel(t)[None, :] / periods[:, None] + phases[:, None]), axis=0).reshape(t.shape)
+
+
+def epoch_seconds(begin):
+    return calendar.timegm(begin.timetuple())
+
+
+def write_synthetic_recording(save_path, begin, seconds, flicker_rate=20000, noise_rate=20000, region=(0, 0, 320, 240),
+                              packets_per_second=10, event_format='bin', seed=0, depth=0.45, height=480, width=640):
+    rng = np.random.default_rng(seed + 1)
+    events_path = save_path + '/' + begin.strftime('dvSave-%Y_%m_%d_%H_%M_%S') + '/events'
+    if not os.path.exists(events_path):
+        os.makedirs(events_path)
+    x0, y0, x1, y1 = region
+    start = epoch_seconds(begin)
+    phase = 0.0
+    writer = EventStoreWriter(events_path) if event_format == 'bin' else None
+    packet = 0
+    for second in range(seconds):
+        # flicker phase on a 0.1 ms grid, carried from one second to the next
+        grid = start + second + np.arange(10001) / 10000
+        grid_phase = phase + 2 * np.pi * 2 * np.concatenate(([0], np.cumsum(synthetic_enf(grid[:-1], seed)))) / 10000
+        phase = grid_phase[-1]
+
+        n_flicker = rng.poisson(flicker_rate)
+        n_noise = rng.poisson(noise_rate)
+        t = rng.integers(0, 1000000, n_flicker + n_noise)
+        flicker = np.arange(n_flicker + n_noise) < n_flicker
+        p_on = np.where(flicker, 0.5 + depth * np.sin(np.interp(t / 1e6, grid - grid[0], grid_phase)), 0.5)
+        p = (rng.random(len(t)) < p_on).astype(np.uint8)
+        x = np.where(flicker, rng.integers(x0, x1, len(t)), rng.integers(0, width, len(t))).astype(np.uint16)
+        y = np.where(flicker, rng.integers(y0, y1, len(t)), rng.integers(0, height, len(t))).astype(np.uint16)
+        order = np.argsort(t, kind='stable')
+        t = t[order] + (start + second) * 1000000
+        x, y, p = x[order], y[order], p[order]
+
+        bounds = np.searchsorted(t, (start + second) * 1000000 + np.arange(1, packets_per_second) * 1000000 // packets_per_second)
+        for a, b in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(t)]))):
+            if writer is not None:
+                writer.append(t[a:b], x[a:b], y[a:b], p[a:b])
+            elif b > a:
+                events = np.array([t[a:b] / 1e6, x[a:b], y[a:b], p[a:b]]).T
+                np.savetxt(events_path + '/events{}.txt'.format(packet), events, fmt='%f %d %d %d')
+            packet = packet + 1
+    if writer is not None:
+        writer.close()
+    return events_path
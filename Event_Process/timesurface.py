@@ -0,0 +1,30 @@
+import numpy as np
+
+# ######## uint8 time-surface renderer
+# A pixel is white (255) without events, NEGATIVE_COLOR if it only saw negative events and
+# POSITIVE_COLOR if it saw a positive one, channels in OpenCV (BGR) order as written by cv2.
+# The renderer keeps one pixel-state buffer and paints every frame with a single lookup into a
+# preallocated uint8 image (or any (height, width, 3) uint8 array, e.g. a slice of a frame stack).
+BACKGROUND_COLOR = (255, 255, 255)
+NEGATIVE_COLOR = (46, 57, 242)
+POSITIVE_COLOR = (242, 121, 57)
+
+
+class TimeSurfaceRenderer:
+    def __init__(self, height=480, width=640):
+        self.height = height
+        self.width = width
+        self.palette = np.array([BACKGROUND_COLOR, NEGATIVE_COLOR, POSITIVE_COLOR], dtype=np.uint8)
+        self.state = np.zeros(height * width, dtype=np.uint8)
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+
+    def render(self, x, y, p, out=None):
+        if out is None:
+            out = self.image
+        self.state.fill(0)
+        pixel = np.asarray(y, dtype=np.intp) * self.width + np.asarray(x, dtype=np.intp)
+        positive = np.asarray(p, dtype=np.uint8).view(bool)  # polarities are 0 / 1, no copy
+        self.state[pixel[~positive]] = 1
+        self.state[pixel[positive]] = 2
+        np.take(self.palette, self.state, axis=0, out=out.reshape(-1, 3))
+        return out
@@ -0,0 +1,130 @@
+import os
+import re
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import cv2
+import numpy as np
+from event_stream import EventStream
+from timesurface import TimeSurfaceRenderer
+
+# ######## Time-surface frames on demand
+# Frames of a recording are rendered from its event store when they are asked for instead of all at
+# unpack time. Frame n covers [begin_time + n / fps, begin_time + (n + 1) / fps) as in
+# events2timesurfaces, and is read from event2ts.npy when the recording was pre-rendered with output='npy'. The last
+# cache_size frames or windows asked for are kept in an LRU cache.
+class TimeSurfaceFrames:
+    def __init__(self, source_path, fps=30, cache_size=256, img_height=480, img_width=640):
+        self.stream = EventStream(source_path + '/events')
+        self.fps = fps
+        self.delta_t = 1e6 / fps
+        self.renderer = TimeSurfaceRenderer(img_height, img_width)
+        self.stack = None
+        if os.path.isfile(source_path + '/event2ts.npy'):
+            self.stack = np.load(source_path + '/event2ts.npy', mmap_mode='r')
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return int((self.stream.final_time - self.stream.begin_time) // self.delta_t)
+
+    def cached(self, key, render):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            img = render()
+            img.flags.writeable = False
+            self.cache[key] = img
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return img
+
+    # events with t0 <= t < t1 (micro-seconds)
+    def window(self, t0, t1):
+        def render():
+            events = self.stream.window(t0, t1)
+            return self.renderer.render(events.x, events.y, events.p).copy()
+        return self.cached((t0, t1), render)
+
+    def frame(self, n):
+        if n < 0 or n >= len(self):
+            raise IndexError('frame {} out of range'.format(n))
+        if self.stack is not None and n < len(self.stack):
+            return self.stack[n]
+        begin = self.stream.begin_time
+        return self.window(begin + int(n * self.delta_t), begin + int((n + 1) * self.delta_t))
+
+    # frame holding the time t (micro-seconds)
+    def at(self, t):
+        return self.frame(int((t - self.stream.begin_time) // self.delta_t))
+
+
+# ######## Small HTTP service over every recording of an Unpacked folder, for the GUI or a browser
+#   GET /<recording>                    {"frames": n, "fps": fps, "begin_time": t0, "final_time": t1}
+#   GET /<recording>/frame/<n>.png
+#   GET /<recording>/time/<t>.png       frame holding the time t (micro-seconds)
+#   GET /<recording>/window/<t0>/<t1>.png
+Routes = [(re.compile(r'^/([^/]+)/frame/(\d+)\.png$'), lambda frames, n: frames.frame(int(n))),
+          (re.compile(r'^/([^/]+)/time/(\d+)\.png$'), lambda frames, t: frames.at(int(t))),
+          (re.compile(r'^/([^/]+)/window/(\d+)/(\d+)\.png$'), lambda frames, t0, t1: frames.window(int(t0), int(t1)))]
+
+
+def make_handler(unpacked_folder, fps, cache_size):
+    recordings = dict()
+    recordings_lock = threading.Lock()
+
+    def get_frames(name):
+        with recordings_lock:
+            if name not in recordings:
+                if not os.path.isdir(unpacked_folder + '/' + name + '/events'):
+                    raise KeyError(name)
+                recordings[name] = TimeSurfaceFrames(unpacked_folder + '/' + name, fps, cache_size)
+            return recordings[name]
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, code, content_type, body):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            try:
+                for pattern, route in Routes:
+                    match = pattern.match(self.path)
+                    if match:
+                        img = route(get_frames(match.group(1)), *match.groups()[1:])
+                        self.reply(200, 'image/png', cv2.imencode('.png', np.ascontiguousarray(img))[1].tobytes())
+                        return
+                match = re.match(r'^/([^/]+)/?$', self.path)
+                if match:
+                    frames = get_frames(match.group(1))
+                    body = '{"frames": %d, "fps": %s, "begin_time": %d, "final_time": %d}' % (
+                        len(frames), frames.fps, frames.stream.begin_time, frames.stream.final_time)
+                    self.reply(200, 'application/json', body.encode())
+                    return
+                self.reply(404, 'text/plain', b'not found')
+            except (KeyError, IndexError) as error:
+                self.reply(404, 'text/plain', str(error).encode())
+
+    return Handler
+
+
+def serve_timesurfaces(unpacked_folder, port=8765, fps=30, cache_size=256, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), make_handler(unpacked_folder.rstrip('/'), fps, cache_size))
+    print('Serving time surfaces of {} on http://{}:{}/'.format(unpacked_folder, host, port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve time-surface frames rendered on demand.')
+    parser.add_argument('unpacked', help='Events/Unpacked folder')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--cache-size', type=int, default=256, help='frames kept per recording')
+    args = parser.parse_args()
+    serve_timesurfaces(args.unpacked, args.port, args.fps, args.cache_size)